@@ -0,0 +1,25 @@
+"""
+    Monthly aggregates of the numeric columns of a dataset, computed once per selection so the
+    temporal graphs read one row per month instead of grouping all the samples again
+"""
+import pandas as pd
+
+STATISTICS = ['count', 'mean', 'median', 'min', 'max']
+
+def monthly_cube(df, by=()):
+    """
+        Table of the count, mean, median, min and max of every numeric column of df for each YearMonth,
+        or for each combination of YearMonth and the columns in by (for example the lake name).
+        The columns are (column name, statistic) pairs and the index is sorted by date.
+    """
+    keys = ['YearMonth'] + list(by)
+    columns = [col for col in df.columns if col not in keys and is_measurement(df[col])]
+    cube = df.groupby(keys, observed=True, sort=True)[columns].agg(STATISTICS)
+    if by:
+        cube.index = cube.index.set_levels(cube.index.levels[0].astype('datetime64[ns]'), level=0)
+    else:
+        cube.index = pd.DatetimeIndex(cube.index.astype('datetime64[ns]'), name='YearMonth')
+    return cube
+
+def is_measurement(column):
+    return pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column)
@@ -1,4 +1,5 @@
 import dash
+import flask
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
@@ -6,12 +7,22 @@ from dash.dependencies import Input, Output
 import numpy as np
 import pandas as pd
 import data_analysis as da
-from settings import months, metadataDB
+from settings import months, JOB_POLL_INTERVAL_MS
 import db_engine as db
+import export
+import jobs
+import schema
 from db_info import db_info
+import json
 import urllib.parse
 
 app = dash.Dash(__name__)
+# the stylesheets are in the assets folder and the component scripts are served from the installed
+# packages, so the app does not depend on any external server
+app.css.config.serve_locally = True
+app.scripts.config.serve_locally = True
+# Flask server of the app, served by the WSGI server of the production setup (see wsgi.py)
+server = app.server
 
 styles = {
     'pre': {
@@ -22,24 +33,72 @@ styles = {
 # initial data frame 
 empty_df = pd.DataFrame()
 
-df1 = pd.read_csv("https://raw.githubusercontent.com/divyachandran-ds/dash1/master/Energy2.csv")
-df = df1.dropna()
 
+def get_selection_key(selected_rows):
+    '''
+        returns the key of the selected databases stored in the hidden layout component
+    '''
+    return json.dumps(sorted(row["DB_ID"] for row in selected_rows))
+
+def get_selected_db_ids(selection_key):
+    '''
+        returns the IDs of the selected databases stored in the selection key
+    '''
+    if not selection_key:
+        return []
+    return json.loads(selection_key)
+
+def get_selected_dataset(selection_key):
+    '''
+        returns the dataset (dataframe and indexes) of the selected databases from the server-side
+        cache of db_engine, which rebuilds it from the data files if it has been evicted
+    '''
+    if not selection_key:
+        return None
+    return db.materialize(json.loads(selection_key))
+
+def get_selected_dataframe(selection_key):
+    '''
+        returns the dataframe of the selected databases
+    '''
+    dataset = get_selected_dataset(selection_key)
+    if dataset is None:
+        return empty_df
+    return dataset.df
+
+def get_selected_monthly_cube(selection_key):
+    '''
+        returns the monthly aggregates of the selected databases
+    '''
+    dataset = get_selected_dataset(selection_key)
+    if dataset is None:
+        return empty_df
+    return dataset.get_monthly_cube()
+
+def get_selected_lake_data(selection_key, selected_loc):
+    '''
+        returns the samples of a lake of the selected databases in date order
+    '''
+    dataset = get_selected_dataset(selection_key)
+    if dataset is None:
+        return empty_df
+    return dataset.get_lake_data(selected_loc)
 
-def convert_to_json(current_dataframe):
+def get_zoomed_range(graph_id, relayout_data):
     '''
-        converts all the data to a JSON string
+        returns the dates zoomed into on a graph when the zoom triggered the callback, or None to draw
+        the whole range. relayoutData keeps the last zoom, so a dropdown change draws the whole range again.
     '''
-    jsonStr = current_dataframe.to_json(orient='split')
-    return jsonStr
+    if graph_id + '.relayoutData' not in [trigger['prop_id'] for trigger in dash.callback_context.triggered]:
+        return None
+    return da.get_x_range(relayout_data)
 
-def convert_to_df(jsonified_data):
+def get_uirevision(*values):
     '''
-        converts the JSON string back to a dataframe
+        returns the uirevision of a graph drawn from the given inputs: the zoom of the graph is kept
+        while they stay the same, and reset when one of them changes
     '''
-    jsonStr = r'{}'.format(jsonified_data)
-    dff = pd.read_json(jsonStr, orient='split')
-    return dff
+    return json.dumps(values, default=str)
 
 def get_metadata_table_content(current_metadata):
     '''
@@ -49,6 +108,21 @@ def get_metadata_table_content(current_metadata):
     table_df = current_metadata[['DB_ID', 'DB_name', 'Uploaded_by', 'Upload_date', 'Microcystin_method', 'N_lakes', 'N_samples']]
     return table_df.to_dict("rows")
 
+def merge_metadata_table_content(table_data, changed_rows):
+    '''
+        returns the rows of the metadata data table with the changed rows replacing the rows
+        of the same database, or added at the end for new databases
+    '''
+    positions = {row['DB_ID']: i for i, row in enumerate(table_data)}
+    table_data = list(table_data)
+    for row in changed_rows:
+        if row['DB_ID'] in positions:
+            table_data[positions[row['DB_ID']]] = row
+        else:
+            positions[row['DB_ID']] = len(table_data)
+            table_data.append(row)
+    return table_data
+
 #Website layout HTML code
 app.layout = html.Div(children=[
     html.Div([
@@ -256,6 +330,12 @@ app.layout = html.Div(children=[
                     placeholder='Description of parameters or URL link'
                 ),
 
+                html.P('Add the rows to an existing database? Rows with the same lake, date and sampling depth as stored rows replace them.'),
+                dcc.Dropdown(
+                    id='upload-target',
+                    placeholder='No, upload a new database',
+                ),
+
                 dcc.Upload(
                         id='upload-data',
                         children=html.Div([
@@ -282,6 +362,9 @@ app.layout = html.Div(children=[
                     }
                 ),
                 html.P(id='upload-msg'),
+                # Hidden div that stores the ID of the running upload job, and the timer that polls its progress
+                html.Div(id='upload-job-id', style={'display': 'none'}),
+                dcc.Interval(id='upload-job-interval', interval=JOB_POLL_INTERVAL_MS, disabled=True),
             ], className="row p"),
         ]),  
     ], className="row"),
@@ -305,7 +388,8 @@ app.layout = html.Div(children=[
             {'name': 'Microcystin Method', 'id': 'Microcystin_method'},
             {'name': 'Number of Lakes', 'id': 'N_lakes'},
             {'name': 'Number of Samples', 'id': 'N_samples'},],
-        data=get_metadata_table_content(metadataDB), 
+        # filled by the refresh callback when the page loads, so the metadata is read per page view
+        data=[], 
         row_selectable='multi',
         selected_rows=[],
         style_as_list_view=True,
@@ -317,22 +401,33 @@ app.layout = html.Div(children=[
             'fontWeight': 'bold'
         },
     ),
+    # Hidden div that stores the change counter of the metadata registry when the table was last refreshed
+    html.Div(id='metadata-version', style={'display': 'none'}, children=0),
 
     html.Button(id='apply-filters-button', children='Filter Data', 
             style={
                 'margin': '10px 0px 10px 0px' 
             }
     ),
-    # Export the selected datasets in a single csv file
+    # Export the selected datasets in a single file, written by the download route when the link is clicked
     html.A(html.Button(id='export-data-button', children='Download Filtered Data',
     		style={
                 'margin': '10px 0px 10px 10px' 
             }),
     	href='',
     	id='download-link',
-    	download='data.csv',
+    	download=export.CSV_FILENAME,
     	target='_blank'
     ),
+    dcc.RadioItems(
+        id='download-format',
+        options=[{'label': 'CSV', 'value': export.CSV_FILENAME},
+                 {'label': 'CSV (gzip)', 'value': export.GZIP_FILENAME},
+                 {'label': 'Parquet', 'value': export.PARQUET_FILENAME}],
+        value=export.CSV_FILENAME,
+        labelStyle={'display': 'inline-block', 'margin-right': '10px'},
+        style={'display': 'inline-block', 'margin-left': '10px'}
+    ),
     # Geographical world map showing concentration locations
     html.Div([
         html.H2('Microcystin Concentration'),
@@ -514,8 +609,8 @@ app.layout = html.Div(children=[
         )
     ], className='row'),
 
-    # Hidden div inside the app that stores the intermediate value
-    html.Div(id='intermediate-value', style={'display': 'none'}, children=convert_to_json(empty_df))
+    # Hidden div inside the app that stores the key of the selected databases
+    html.Div(id='intermediate-value', style={'display': 'none'}, children='')
 ])
 
 # Controls if text fields are visible based on selected options in upload questionnaire
@@ -596,30 +691,47 @@ def show_filter_size(visibility_state):
         return {'display': 'none'}
 
 @app.callback(
-    dash.dependencies.Output('metadata_table', 'data'),
-    [dash.dependencies.Input('refresh-db-button', 'n_clicks')])
-def upload_file(n_clicks):
-    # read from MetadataDB to update the table 
-    metadataDB = pd.read_csv("data/MetadataDB.csv")
-    return get_metadata_table_content(metadataDB)
+    [dash.dependencies.Output('metadata_table', 'data'),
+     dash.dependencies.Output('metadata-version', 'children')],
+    [dash.dependencies.Input('refresh-db-button', 'n_clicks')],
+    [dash.dependencies.State('metadata_table', 'data'),
+     dash.dependencies.State('metadata-version', 'children')])
+def refresh_metadata_table(n_clicks, table_data, version):
+    # read the databases added or changed since the last refresh to update the table, also when the page loads
+    version, changed_metadata = db.metadata_registry.get_changes(version or 0)
+    return merge_metadata_table_content(table_data or [], get_metadata_table_content(changed_metadata)), version
+
+@app.callback(
+    dash.dependencies.Output('upload-target', 'options'),
+    [dash.dependencies.Input('metadata_table', 'data')])
+def update_upload_targets(table_data):
+    # the databases that rows can be added to are the ones listed in the metadata table
+    return [{'label': row['DB_name'], 'value': row['DB_ID']} for row in table_data or []]
 
 @app.callback(
     dash.dependencies.Output('geo_plot', 'figure'),
     [dash.dependencies.Input('year-dropdown', 'value'),
      dash.dependencies.Input('month-slider', 'value'),
      dash.dependencies.Input('geo_plot_option','value'),
+     dash.dependencies.Input('geo_plot', 'relayoutData'),
      dash.dependencies.Input('intermediate-value', 'children')])
-def update_geo_plot(selected_years, selected_month, geo_option, jsonified_data):
-    dff = convert_to_df(jsonified_data)
-    return da.geo_plot(selected_years, selected_month, geo_option, dff)
+def update_geo_plot(selected_years, selected_month, geo_option, relayout_data, selection_key):
+    dataset = get_selected_dataset(selection_key)
+    if dataset is None:
+        return da.geo_plot(selected_years, selected_month, geo_option, empty_df)
+    # zooming or panning the map fetches only the points in the new view from the spatial index,
+    # and the zoom scale sets the size of the clusters when there are too many points to draw
+    viewport = da.get_geo_viewport(relayout_data)
+    scale = da.get_geo_scale(relayout_data)
+    return da.geo_plot(selected_years, selected_month, geo_option, dataset.df, dataset.spatial_index, viewport, scale)
 
 @app.callback(
     dash.dependencies.Output('comparison_scatter', 'figure'),
     [dash.dependencies.Input('compare-y-axis', 'value'),
     dash.dependencies.Input('compare-x-axis', 'value'),
     dash.dependencies.Input('intermediate-value', 'children')])
-def update_comparison(selected_y, selected_x, jsonified_data):
-    dff = convert_to_df(jsonified_data)
+def update_comparison(selected_y, selected_x, selection_key):
+    dff = get_selected_dataframe(selection_key)
     return da.comparison_plot(selected_y, selected_x, dff)
 
 # TODO: Correlation matrix in progress
@@ -627,63 +739,74 @@ def update_comparison(selected_y, selected_x, jsonified_data):
 #     dash.dependencies.Output('correlation-graph', 'figure'),
 #     [dash.dependencies.Input('correlation-dropdown', 'value'),
 #     dash.dependencies.Input('intermediate-value', 'children')])
-# def update_correlation(selected_dataset, jsonified_data):
-#     dff = convert_to_df(jsonified_data)
+# def update_correlation(selected_dataset, selection_key):
+#     dff = get_selected_dataframe(selection_key)
 #     return da.correlation_plot(selected_dataset, dff)
 
 @app.callback(
     dash.dependencies.Output('temporal-lake-scatter', 'figure'),
     [dash.dependencies.Input('temporal-lake-col', 'value'),
      dash.dependencies.Input('temporal-lake-location', 'value'),
+     dash.dependencies.Input('temporal-lake-scatter', 'relayoutData'),
      dash.dependencies.Input('intermediate-value', 'children')])
-def update_temporal_output(selected_col, selected_loc, jsonified_data):
-    dff = convert_to_df(jsonified_data)
-    return da.temporal_lake(selected_col, selected_loc, 'raw', dff)
+def update_temporal_output(selected_col, selected_loc, relayout_data, selection_key):
+    lake_data = get_selected_lake_data(selection_key, selected_loc)
+    return da.temporal_lake(selected_col, 'raw', lake_data, get_zoomed_range('temporal-lake-scatter', relayout_data),
+                            get_uirevision(selected_col, selected_loc, selection_key))
 
 @app.callback(
     dash.dependencies.Output('temporal-lake-pc-scatter', 'figure'),
     [dash.dependencies.Input('temporal-lake-col', 'value'),
      dash.dependencies.Input('temporal-lake-location', 'value'),
+     dash.dependencies.Input('temporal-lake-pc-scatter', 'relayoutData'),
      dash.dependencies.Input('intermediate-value', 'children')])
-def update_output(selected_col, selected_loc, jsonified_data):
-    dff = convert_to_df(jsonified_data)
-    return da.temporal_lake(selected_col, selected_loc, 'pc', dff)
+def update_output(selected_col, selected_loc, relayout_data, selection_key):
+    lake_data = get_selected_lake_data(selection_key, selected_loc)
+    return da.temporal_lake(selected_col, 'pc', lake_data, get_zoomed_range('temporal-lake-pc-scatter', relayout_data),
+                            get_uirevision(selected_col, selected_loc, selection_key))
 
 @app.callback(
     dash.dependencies.Output('tn_tp_scatter', 'figure'),
     [dash.dependencies.Input('tn_range', 'value'),
      dash.dependencies.Input('tp_range', 'value'),
      dash.dependencies.Input('intermediate-value', 'children')])
-def update_output(tn_val, tp_val, jsonified_data):
-    dff = convert_to_df(jsonified_data)
-    return da.tn_tp(tn_val, tp_val, dff)
+def update_output(tn_val, tp_val, selection_key):
+    # the ranges are queried on the stored files, so the selection does not have to be loaded
+    return da.tn_tp_query(tn_val, tp_val, get_selected_db_ids(selection_key))
 
 @app.callback(
     dash.dependencies.Output('temporal-avg-scatter', 'figure'),
     [dash.dependencies.Input('temporal-avg-col', 'value'),
     dash.dependencies.Input('intermediate-value', 'children')])
-def update_output(selected_col, jsonified_data):
-    dff = convert_to_df(jsonified_data)
-    return da.temporal_overall(selected_col, 'avg', dff)
+def update_output(selected_col, selection_key):
+    monthly_cube = get_selected_monthly_cube(selection_key)
+    return da.temporal_overall(selected_col, 'avg', monthly_cube)
 
 @app.callback(
     dash.dependencies.Output('temporal-pc-scatter', 'figure'),
     [dash.dependencies.Input('temporal-avg-col', 'value'),
     dash.dependencies.Input('intermediate-value', 'children')])
-def update_output(selected_col, jsonified_data):
-    dff = convert_to_df(jsonified_data)
-    return da.temporal_overall(selected_col, 'pc', dff)
+def update_output(selected_col, selection_key):
+    monthly_cube = get_selected_monthly_cube(selection_key)
+    return da.temporal_overall(selected_col, 'pc', monthly_cube)
 
 @app.callback(
     dash.dependencies.Output('temporal-raw-scatter', 'figure'),
     [dash.dependencies.Input('temporal-raw-option', 'value'),
      dash.dependencies.Input('temporal-raw-col', 'value'),
      dash.dependencies.Input('axis_range_raw', 'value'),
+     dash.dependencies.Input('temporal-raw-scatter', 'relayoutData'),
      dash.dependencies.Input('intermediate-value', 'children')
 ])
-def update_output(selected_option, selected_col, log_range, jsonified_data):
-    dff = convert_to_df(jsonified_data)
-    return da.temporal_raw(selected_option, selected_col, log_range, dff)
+def update_output(selected_option, selected_col, log_range, relayout_data, selection_key):
+    x_range = get_zoomed_range('temporal-raw-scatter', relayout_data)
+    uirevision = get_uirevision(selected_option, selected_col, log_range, selection_key)
+    if db.is_stored_column(selected_col):
+        return da.temporal_raw_query(selected_option, selected_col, log_range, get_selected_db_ids(selection_key),
+                                     x_range, uirevision)
+    # derived columns only exist in the loaded selection
+    dff = get_selected_dataframe(selection_key)
+    return da.temporal_raw(selected_option, selected_col, log_range, dff, x_range, uirevision)
 
 @app.callback(dash.dependencies.Output('upload-output', 'children'),
               [dash.dependencies.Input('upload-data', 'contents')],
@@ -695,7 +818,7 @@ def update_uploaded_file(contents, filename):
         ])
 
 @app.callback(
-    dash.dependencies.Output('upload-msg', 'children'),
+    dash.dependencies.Output('upload-job-id', 'children'),
     [dash.dependencies.Input('upload-button', 'n_clicks')],
     [dash.dependencies.State('db-name', 'value'),
     dash.dependencies.State('user-name', 'value'),
@@ -713,17 +836,25 @@ def update_uploaded_file(contents, filename):
     dash.dependencies.State('microcystin-method', 'value'),
     dash.dependencies.State('filter-size', 'value'),
     dash.dependencies.State('cell-count-url', 'value'),
-    dash.dependencies.State('ancillary-data', 'value')])
-def upload_file(n_clicks, dbname, username, userinst, contents, filename, publicationURL, fieldMURL, labMURL, QAQCUrl, fullQAQCUrl, substrate, sampleType, fieldMethod, microcystinMethod, filterSize, cellCountURL, ancillaryURL):
+    dash.dependencies.State('ancillary-data', 'value'),
+    dash.dependencies.State('upload-target', 'value'),
+    dash.dependencies.State('metadata_table', 'data')])
+def upload_file(n_clicks, dbname, username, userinst, contents, filename, publicationURL, fieldMURL, labMURL, QAQCUrl, fullQAQCUrl, substrate, sampleType, fieldMethod, microcystinMethod, filterSize, cellCountURL, ancillaryURL, target_db_id, table_data):
     if n_clicks != None and n_clicks > 0:
-        if username == None or not username.strip():
-            return 'Name field cannot be empty.'
+        if target_db_id is not None:
+            if contents is None:
+                return json.dumps({'error': 'Please select a file.'})
+            # add the rows of the file to the selected database in a background worker
+            db_names = {row['DB_ID']: row['DB_name'] for row in table_data or []}
+            return json.dumps({'job_id': jobs.submit_append(target_db_id, db_names.get(target_db_id, target_db_id), contents, filename)})
+        elif username == None or not username.strip():
+            return json.dumps({'error': 'Name field cannot be empty.'})
         elif userinst == None or not userinst.strip():
-            return 'Institution cannot be empty.'
+            return json.dumps({'error': 'Institution cannot be empty.'})
         elif dbname == None or not dbname.strip():
-            return 'Database name cannot be empty.'
+            return json.dumps({'error': 'Database name cannot be empty.'})
         elif contents is None:
-            return 'Please select a file.'
+            return json.dumps({'error': 'Please select a file.'})
         else:
             new_db = db_info(dbname, username, userinst)
             new_db.db_publication_url = publicationURL
@@ -739,7 +870,33 @@ def upload_file(n_clicks, dbname, username, userinst, contents, filename, public
             new_db.db_cell_count_method = cellCountURL
             new_db.db_ancillary_url = ancillaryURL
 
-            return db.upload_new_database(new_db, contents, filename)
+            # parse the file in a background worker and poll its progress
+            return json.dumps({'job_id': jobs.submit_upload(new_db, contents, filename)})
+
+@app.callback(
+    [dash.dependencies.Output('upload-msg', 'children'),
+     dash.dependencies.Output('upload-job-interval', 'disabled')],
+    [dash.dependencies.Input('upload-job-interval', 'n_intervals'),
+     dash.dependencies.Input('upload-job-id', 'children')])
+def update_upload_progress(n_intervals, job_info):
+    if not job_info:
+        return '', True
+    try:
+        job_info = json.loads(job_info)
+        if 'error' in job_info:
+            return job_info['error'], True
+        status = jobs.read_status(job_info.get('job_id'))
+    except (ValueError, TypeError, AttributeError, OSError):
+        # an invalid job ID, or a job whose files have expired
+        return 'This upload could not be found.', True
+    if status['status'] in ('queued', 'running'):
+        msg = 'Uploading "{}": {:.0%} ({} rows)'.format(status['db_name'], status['progress'], status['rows'])
+        return msg, False
+
+    msg = status['message']
+    if status['failed_rows'] > 0:
+        msg += ' {} rows could not be read and were skipped.'.format(status['failed_rows'])
+    return msg, True
 
 @app.callback(
     [dash.dependencies.Output('intermediate-value', 'children'),
@@ -774,13 +931,13 @@ def update_graph(n_clicks, derived_virtual_selected_rows, dt_rows):
         selected_rows = [dt_rows[i] for i in derived_virtual_selected_rows]
         new_df = db.update_dataframe(selected_rows)
         print("NEW DF: ", new_df)
+        selection_key = get_selection_key(selected_rows)
 
         # List of datasets and notice for correlation matrix
         correlation_notice = {'display': 'block'}
         db_name = [{'label': row['DB_name'], 'value': row['DB_name']} for row in selected_rows]
         db_value = db_name[0]
-        
-        jsonStr = convert_to_json(new_df)
+
 
         # update range for raw data graph
         raw_range_max = np.max(new_df["Microcystin (ug/L)"])
@@ -793,8 +950,8 @@ def update_graph(n_clicks, derived_virtual_selected_rows, dt_rows):
         tp_value = [0, np.max(new_df["Total Phosphorus (ug/L)"])]
         
         # update the date ranges
-        year = pd.to_datetime(new_df['DATETIME']).dt.year
-        years = range(np.min(year), np.max(year)+1)
+        year = new_df['Year'].cat.categories
+        years = range(int(np.min(year)), int(np.max(year))+1)
         years_options = [{'label': str(y), 'value': y} for y in years]
 
         # update the lake locations 
@@ -803,49 +960,47 @@ def update_graph(n_clicks, derived_virtual_selected_rows, dt_rows):
         locs_options = [{'label': loc, 'value': loc} for loc in locs]
         locs_value = locs[0]
 
-        # get current existing column names and remove general info to update the dropdowns of plot axes
-        colNames = new_df.columns.values.tolist()
-        if 'DATETIME' in colNames: colNames.remove('DATETIME')
-        if 'Body of Water Name' in colNames: colNames.remove('Body of Water Name')
-        if 'DataContact' in colNames: colNames.remove('DataContact')
-        if 'LONG' in colNames: colNames.remove('LONG')
-        if 'LAT' in colNames: colNames.remove('LAT')
-        if 'Comments' in colNames: colNames.remove('Comments')
-        if 'MC Percent Change' in colNames: colNames.remove('MC Percent Change')
-        if 'Maximum Depth (m)' in colNames: colNames.remove('Maximum Depth (m)')
-        if 'Mean Depth (m)' in colNames: colNames.remove('Mean Depth (m)')
-
-        colNames.sort()
+        # the columns of the selected databases that can be drawn, from the column registry and the stored file schemas
+        colNames = schema.get_plottable_columns(db.get_columns([row["DB_ID"] for row in selected_rows]))
         col_options = [{'label': col, 'value': col} for col in colNames]
         col_value = colNames[0]
         col_value_next = colNames[1]
 
-        return jsonStr, tn_max, tn_value, tp_max, tp_value, years_options, years_options, locs_options, locs_value, col_options, col_value, col_options, col_value, col_options, col_value, raw_range_max, raw_range_value, col_options, col_value, col_options, col_value_next, # db_name, db_value
+        return selection_key, tn_max, tn_value, tp_max, tp_value, years_options, years_options, locs_options, locs_value, col_options, col_value, col_options, col_value, col_options, col_value, raw_range_max, raw_range_value, col_options, col_value, col_options, col_value_next, # db_name, db_value
 
-# Update the download link to contain the data from the selected datasheets
+# Update the download link to point to the download route for the selected datasheets
 @app.callback(
- 	dash.dependencies.Output('download-link', 'href'),
- 	[dash.dependencies.Input('apply-filters-button', 'n_clicks')],
-	[dash.dependencies.State('metadata_table', 'derived_virtual_selected_rows'),
-     dash.dependencies.State('metadata_table', 'derived_virtual_data')])
-def update_data_download_link(n_clicks, derived_virtual_selected_rows, dt_rows):
-	if n_clicks != None and n_clicks > 0 and derived_virtual_selected_rows is not None:
-		selected_rows = [dt_rows[i] for i in derived_virtual_selected_rows]
-		dff = db.update_dataframe(selected_rows)
-
-		csv_string = dff.to_csv(index=False, encoding='utf-8')
-		csv_string = "data:text/csv;charset=utf-8," + urllib.parse.quote(csv_string)
-		return csv_string
-
-external_css = ["https://cdnjs.cloudflare.com/ajax/libs/skeleton/2.0.4/skeleton.min.css",
-                "//fonts.googleapis.com/css?family=Raleway:400,300,600",
-                "//fonts.googleapis.com/css?family=Dosis:Medium",
-                "https://cdn.rawgit.com/plotly/dash-app-stylesheets/62f0eb4f1fadbefea64b2404493079bf848974e8/dash-uber-ride-demo.css",
-                "https://maxcdn.bootstrapcdn.com/font-awesome/4.7.0/css/font-awesome.min.css",
-                "https://codepen.io/chriddyp/pen/bWLwgP.css"]
-
-for css in external_css:
-    app.css.append_css({"external_url": css})
+    [dash.dependencies.Output('download-link', 'href'),
+     dash.dependencies.Output('download-link', 'download')],
+    [dash.dependencies.Input('intermediate-value', 'children'),
+     dash.dependencies.Input('download-format', 'value')])
+def update_data_download_link(selection_key, download_format):
+    if not selection_key:
+        return '', download_format
+    return '/download/{}?{}'.format(download_format, urllib.parse.urlencode({'selection': selection_key})), download_format
+
+@server.route('/download/<filename>')
+def download_data(filename):
+    '''
+        streams the rows of the selected databases, read from the stored files a few thousand rows
+        at a time, as the CSV, gzip compressed CSV or Parquet file named by filename
+    '''
+    if filename not in export.DOWNLOAD_FORMATS:
+        flask.abort(404)
+    try:
+        db_ids = json.loads(flask.request.args.get('selection'))
+    except (ValueError, TypeError):
+        # the selection is missing or is not JSON
+        flask.abort(400)
+    if not isinstance(db_ids, list) or not all(isinstance(db_id, str) for db_id in db_ids):
+        flask.abort(400)
+    # a selection of databases that do not exist (any more) has no rows to download
+    tables = db.query_batches(db_ids) if db_ids else None
+    if tables is None:
+        flask.abort(404)
+    mimetype, write_chunks = export.DOWNLOAD_FORMATS[filename]
+    return flask.Response(flask.stream_with_context(write_chunks(tables)), mimetype=mimetype,
+                          headers={'Content-Disposition': 'attachment; filename=' + filename})
 
 if __name__ == '__main__':
     app.run_server(debug=True)
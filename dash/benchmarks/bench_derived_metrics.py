@@ -0,0 +1,55 @@
+"""
+    Benchmark of the derived metrics stage (TN:TP, Microcystin:Chlorophyll a, MC Percent Change)
+    on synthetic data from 10 thousand to 4 million samples. The time per million rows should stay
+    roughly constant as the row count grows. The previous per-site lambda is timed on the smaller sizes.
+    Run from the dash directory: python benchmarks/bench_derived_metrics.py
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_engine import add_derived_metrics
+
+ROW_COUNTS = [10000, 100000, 1000000, 2000000, 4000000]
+LAMBDA_MAX_ROWS = 100000
+SAMPLES_PER_SITE = 40
+
+def make_samples(n_rows):
+    rng = np.random.RandomState(0)
+    n_sites = max(1, n_rows // SAMPLES_PER_SITE)
+    site = rng.randint(0, n_sites, n_rows)
+    dates = pd.Timestamp('2000-01-01') + pd.to_timedelta(rng.randint(0, 7000, n_rows), unit='D')
+    mc = rng.lognormal(0, 1, n_rows)
+    mc[rng.rand(n_rows) < 0.1] = np.nan
+    return pd.DataFrame({
+        'DATETIME': dates,
+        'LAT': 40 + site * 1e-4,
+        'LONG': -100 - site * 1e-4,
+        'Total Nitrogen (ug/L)': rng.uniform(100, 5000, n_rows),
+        'Total Phosphorus (ug/L)': rng.uniform(0, 500, n_rows),
+        'Total Chlorophyll a (ug/L)': rng.uniform(0, 100, n_rows),
+        'Microcystin (ug/L)': mc,
+    })
+
+def lambda_percent_change(df):
+    return df.sort_values("DATETIME").\
+        groupby(['LONG', 'LAT'], group_keys=False)["Microcystin (ug/L)"].\
+        apply(lambda x: x.ffill().pct_change()).fillna(0)
+
+if __name__ == '__main__':
+    print('%10s %14s %16s %14s' % ('rows', 'vectorized (s)', 's per 1M rows', 'lambda (s)'))
+    for n_rows in ROW_COUNTS:
+        df = make_samples(n_rows)
+        start = time.perf_counter()
+        add_derived_metrics(df)
+        elapsed = time.perf_counter() - start
+
+        lambda_time = ''
+        if n_rows <= LAMBDA_MAX_ROWS:
+            start = time.perf_counter()
+            lambda_percent_change(df)
+            lambda_time = '%.3f' % (time.perf_counter() - start)
+        print('%10d %14.3f %16.3f %14s' % (n_rows, elapsed, elapsed / n_rows * 1e6, lambda_time))
@@ -0,0 +1,68 @@
+"""
+    Benchmark of the memory of a loaded database of 10,000 to 1,000,000 rows in the GLEON template,
+    stored with the default column types against the compact types chosen by dtype_optimizer.
+    Reports the measured memory of the loaded dataframes and the estimate given in the upload message.
+    Run from the dash directory: python benchmarks/bench_dtypes.py
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_engine import ParquetStorage, ingest, format_chunk, to_storage_types, set_date_categories
+
+ROW_COUNTS = [10000, 100000, 1000000]
+ANALYTES = ['TP_mgL', 'TN_mgL', 'NO3NO2_mgL', 'NH4_mgL', 'PO4_ugL', 'Chlorophylla_ugL', 'TotalMC_ug/L', 'DissolvedMC_ugL',
+            'MC_LR_ugL', 'MC_RR_ugL', 'SecchiDepth_m', 'SurfaceTemperature_C', 'PercentCyano']
+COUNTS = ['TotalPhyto_CellsmL', 'Cyano_CellsmL', 'mcyD_genemL', 'mcyE_genemL']
+
+def make_upload(n_rows):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({
+        'Date': pd.Timestamp('2005-01-01') + pd.to_timedelta(np.sort(rng.randint(0, 5000, n_rows)), unit='D'),
+        'LakeName': ['Lake %d' % (i % 200) for i in range(n_rows)],
+        'Lat': rng.uniform(40, 60, n_rows).round(5),
+        'Long': rng.uniform(-120, -80, n_rows).round(5),
+        'DominantBloomGenera': rng.choice(['Microcystis', 'Dolichospermum', 'Planktothrix', None], n_rows),
+        'DataContact': 'contact@example.org',
+    })
+    # measurements as written by the labs, with a few significant digits
+    for col in ANALYTES:
+        df[col] = rng.lognormal(0, 1, n_rows).round(3)
+    for col in COUNTS:
+        df[col] = np.where(rng.uniform(size=n_rows) < 0.2, np.nan, rng.randint(0, 10 ** 6, n_rows))
+    return df
+
+def store_default(path, chunks):
+    # the chunks written as they are formatted, without the compact types
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(to_storage_types(chunk), preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table.cast(writer.schema))
+    writer.close()
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = ParquetStorage(tmp_dir, 'zstd')
+        print('%10s %14s %14s %14s %10s' % ('rows', 'default (MB)', 'compact (MB)', 'estimate (MB)', 'saved'))
+        for n_rows in ROW_COUNTS:
+            chunks = [format_chunk(chunk) for chunk in ingest.split_dataframe(make_upload(n_rows))]
+            default_path = os.path.join(tmp_dir, 'default_%d.parquet' % n_rows)
+            store_default(default_path, chunks)
+            appender = storage.open_appender('compact_%d' % n_rows)
+            for chunk in chunks:
+                appender.append(chunk)
+            appender.close()
+
+            default_df = set_date_categories(pq.read_table(default_path).to_pandas())
+            compact_df = storage.read('compact_%d' % n_rows)
+            default_bytes = default_df.memory_usage(deep=True).sum()
+            compact_bytes = compact_df.memory_usage(deep=True).sum()
+            print('%10d %14.1f %14.1f %14.1f %9.0f%%' % (n_rows, default_bytes / 1e6, compact_bytes / 1e6,
+                                                         appender.memory_usage[1] / 1e6, 100 * (1 - compact_bytes / default_bytes)))
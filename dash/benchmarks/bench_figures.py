@@ -0,0 +1,53 @@
+"""
+    Benchmark of figure build time and serialized payload size for the scatter graphs at
+    1 thousand, 100 thousand and 1 million points, with SVG and WebGL traces.
+    The payload is measured as the JSON sent to the browser by Dash. WebGL traces mostly speed up
+    drawing in the browser, which is not measured here; on the server both trace types cost about the same.
+    Run from the dash directory: python benchmarks/bench_figures.py
+"""
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import plotly
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import data_analysis as da
+
+POINT_COUNTS = [1000, 100000, 1000000]
+
+def make_samples(n_rows):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({
+        'DATETIME': pd.Timestamp('2000-01-01') + pd.to_timedelta(np.sort(rng.randint(0, 7000, n_rows)), unit='D'),
+        'Body of Water Name': pd.Categorical.from_codes(rng.randint(0, 500, n_rows), ['Lake number %d' % i for i in range(500)]),
+        'Total Nitrogen (ug/L)': rng.uniform(100, 5000, n_rows),
+        'Total Phosphorus (ug/L)': rng.uniform(5, 500, n_rows),
+        'Microcystin (ug/L)': rng.lognormal(0, 2, n_rows),
+    })
+
+def measure(build):
+    start = time.perf_counter()
+    fig = build()
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    payload = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+    return build_time, time.perf_counter() - start, len(payload)
+
+if __name__ == '__main__':
+    graphs = {
+        'tn_tp': lambda df: da.tn_tp([0, 0], [0, 0], df),
+        'comparison': lambda df: da.comparison_plot('Total Phosphorus (ug/L)', 'Total Nitrogen (ug/L)', df),
+        'temporal_raw': lambda df: da.temporal_raw('RAW', 'Microcystin (ug/L)', [0, 0], df),
+    }
+    print('%-13s %-6s %9s %10s %13s %13s' % ('graph', 'mode', 'points', 'build (s)', 'to JSON (s)', 'payload (MB)'))
+    for n_points in POINT_COUNTS:
+        df = make_samples(n_points)
+        for name, build in graphs.items():
+            for mode in ['never', 'always']:
+                da.WEBGL_MODE = mode
+                build_time, json_time, size = measure(lambda: build(df))
+                print('%-13s %-6s %9d %10.3f %13.3f %13.2f' % (name, 'svg' if mode == 'never' else 'webgl',
+                                                               n_points, build_time, json_time, size / 1e6))
@@ -0,0 +1,63 @@
+"""
+    Benchmark of the serialized size of the graphs with hover text, against the previous hover text
+    where every trace carried the lake name column of the whole dataframe.
+    Run from the dash directory: python benchmarks/bench_hover_payload.py
+"""
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import plotly
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import data_analysis as da
+
+ROW_COUNTS = [1000, 10000, 100000]
+
+def make_samples(n_rows):
+    rng = np.random.RandomState(0)
+    dates = pd.Timestamp('2000-01-01') + pd.to_timedelta(np.sort(rng.randint(0, 7000, n_rows)), unit='D')
+    return pd.DataFrame({
+        'DATETIME': dates,
+        'Year': pd.Categorical(dates.year),
+        'Month': pd.Categorical(dates.month),
+        'Body of Water Name': pd.Categorical.from_codes(rng.randint(0, 500, n_rows), ['Lake number %d' % i for i in range(500)]),
+        'LAT': rng.uniform(-60, 70, n_rows),
+        'LONG': rng.uniform(-180, 180, n_rows),
+        'Total Nitrogen (ug/L)': rng.uniform(100, 5000, n_rows),
+        'Total Phosphorus (ug/L)': rng.uniform(5, 500, n_rows),
+        'Microcystin (ug/L)': rng.lognormal(0, 2, n_rows),
+        'MC Percent Change': rng.normal(0, 50, n_rows),
+    })
+
+def payload_size(fig):
+    return len(json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder))
+
+def legacy_payload_size(fig, df):
+    # the previous graphs passed the whole lake name column as the text of every trace
+    fig = go_dict(fig)
+    for trace in fig['data']:
+        trace.pop('hovertemplate', None)
+        trace['text'] = df['Body of Water Name']
+    return payload_size(fig)
+
+def go_dict(fig):
+    if isinstance(fig, dict):
+        return {'data': [trace.to_plotly_json() for trace in fig['data']], 'layout': fig['layout']}
+    return fig.to_plotly_json()
+
+if __name__ == '__main__':
+    graphs = {
+        'tn_tp': lambda df: da.tn_tp([0, 0], [0, 0], df),
+        # the map of one year, whose trace the previous hover text filled with the names of every year
+        'geo_log': lambda df: da.geo_plot(df['Year'].cat.categories[0], list(range(1, 13)), 'LOG', df),
+        'geo_conc': lambda df: da.geo_concentration_plot(df),
+    }
+    print('%-9s %8s %13s %13s %8s' % ('graph', 'rows', 'before (MB)', 'after (MB)', 'ratio'))
+    for n_rows in ROW_COUNTS:
+        df = make_samples(n_rows)
+        for name, build in graphs.items():
+            fig = build(df)
+            before, after = legacy_payload_size(fig, df), payload_size(fig)
+            print('%-9s %8d %13.2f %13.2f %8.1f' % (name, n_rows, before / 1e6, after / 1e6, before / after))
@@ -0,0 +1,62 @@
+"""
+    Benchmark of loading and combining the selected databases, comparing the previous
+    database-by-database pd.concat with the parallel single-concat loader.
+    Run from the dash directory: python benchmarks/bench_loader.py
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_engine import ParquetStorage
+
+ROWS_PER_DATASET = 2000
+DATASET_COUNTS = [5, 50, 100, 250, 500]
+
+def make_dataset(seed, n_rows):
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({
+        'DATETIME': pd.date_range('2005-01-01', periods=n_rows, freq='D').strftime('%Y-%m-%d %H:%M:%S'),
+        'Body of Water Name': ['Lake %d' % (i % 20) for i in range(n_rows)],
+        'LAT': rng.uniform(40, 60, n_rows),
+        'LONG': rng.uniform(-120, -80, n_rows),
+        'Total Nitrogen (ug/L)': rng.uniform(100, 5000, n_rows),
+        'Total Phosphorus (ug/L)': rng.uniform(5, 500, n_rows),
+        'Microcystin (ug/L)': rng.lognormal(0, 1, n_rows),
+    })
+    # vary the column sets between datasets as real uploads do
+    if seed % 3 == 0:
+        df['Total Chlorophyll a (ug/L)'] = rng.uniform(1, 100, n_rows)
+    if seed % 5 == 0:
+        df['Secchi Depth (m)'] = rng.randint(0, 10, n_rows)
+    return df
+
+def load_incremental(storage, db_ids):
+    new_dataframe = pd.DataFrame()
+    for db_id in db_ids:
+        db_data = storage.read(db_id)
+        new_dataframe = pd.concat([new_dataframe, db_data], sort=False).reset_index(drop=True)
+    return new_dataframe
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = ParquetStorage(tmp_dir, 'zstd')
+        db_ids = ['db_%d' % i for i in range(max(DATASET_COUNTS))]
+        for i, db_id in enumerate(db_ids):
+            storage.write(db_id, make_dataset(i, ROWS_PER_DATASET))
+
+        print('%10s %12s %12s %10s' % ('datasets', 'concat (s)', 'loader (s)', 'speedup'))
+        for count in DATASET_COUNTS:
+            selected = db_ids[:count]
+            old_time, old_df = timed(load_incremental, storage, selected)
+            new_time, new_df = timed(storage.read_many, selected)
+            assert old_df.shape == new_df.shape
+            print('%10d %12.3f %12.3f %9.1fx' % (count, old_time, new_time, old_time / new_time))
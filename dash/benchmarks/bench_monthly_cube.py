@@ -0,0 +1,46 @@
+"""
+    Benchmark of the monthly averages graph: grouping all the samples by month on every call,
+    as the graph used to, against reading the monthly aggregates computed once per selection.
+    Run from the dash directory: python benchmarks/bench_monthly_cube.py
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import data_analysis as da
+from aggregates import monthly_cube
+
+ROW_COUNTS = [10000, 100000, 1000000]
+COLUMNS = ['Total Nitrogen (ug/L)', 'Total Phosphorus (ug/L)', 'Microcystin (ug/L)', 'Chlorophyll a (ug/L)']
+
+def make_samples(n_rows):
+    rng = np.random.RandomState(0)
+    dates = pd.Timestamp('2000-01-01') + pd.to_timedelta(rng.randint(0, 7000, n_rows), unit='D')
+    df = pd.DataFrame({col: rng.lognormal(3, 1, n_rows) for col in COLUMNS})
+    df['YearMonth'] = pd.Categorical(dates.to_period('M').to_timestamp())
+    return df
+
+def group_by_month(df, col):
+    monthly = df[['YearMonth', col]].groupby('YearMonth', observed=True).agg(['mean'])
+    return monthly[col]['mean']
+
+def best_time(function, repeat=5):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+if __name__ == '__main__':
+    print('%9s %15s %15s %16s' % ('rows', 'groupby (ms)', 'build cube (ms)', 'cube graph (ms)'))
+    for n_rows in ROW_COUNTS:
+        df = make_samples(n_rows)
+        cube = monthly_cube(df)
+        groupby_time = best_time(lambda: group_by_month(df, COLUMNS[0]))
+        build_time = best_time(lambda: monthly_cube(df), repeat=1)
+        graph_time = best_time(lambda: da.temporal_overall(COLUMNS[0], 'avg', cube))
+        print('%9d %15.1f %15.1f %16.1f' % (n_rows, groupby_time * 1000, build_time * 1000, graph_time * 1000))
@@ -0,0 +1,68 @@
+"""
+    Benchmark of a selective range query (the TN vs TP graph filters) over 10 to 500 databases:
+    loading the whole selection and filtering it with pandas, against the queries of db_engine
+    that run the filters on the stored files. Reports the time and the memory of the loaded rows.
+    Run from the dash directory: python benchmarks/bench_query.py
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_engine import ParquetStorage, add_date_fields
+
+ROWS_PER_DATASET = 20000
+DATASET_COUNTS = [10, 100, 500]
+COLUMNS = ['Total Nitrogen (ug/L)', 'Total Phosphorus (ug/L)', 'Microcystin (ug/L)', 'Body of Water Name']
+# about 2% of the samples are in the queried ranges
+FILTERS = [('Total Nitrogen (ug/L)', '>=', 4000), ('Total Phosphorus (ug/L)', '>=', 450)]
+
+def make_dataset(seed, n_rows):
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({
+        'DATETIME': pd.Timestamp('2005-01-01') + pd.to_timedelta(np.sort(rng.randint(0, 5000, n_rows)), unit='D'),
+        'Body of Water Name': ['Lake %d' % (i % 20) for i in range(n_rows)],
+        'LAT': rng.uniform(40, 60, n_rows),
+        'LONG': rng.uniform(-120, -80, n_rows),
+        'Total Nitrogen (ug/L)': rng.uniform(100, 5000, n_rows),
+        'Total Phosphorus (ug/L)': rng.uniform(5, 500, n_rows),
+        'Microcystin (ug/L)': rng.lognormal(0, 1, n_rows),
+        'Total Chlorophyll a (ug/L)': rng.uniform(1, 100, n_rows),
+    })
+    return add_date_fields(df)
+
+def load_and_filter(storage, db_ids):
+    df = storage.read_many(db_ids)
+    loaded_bytes = df.memory_usage(deep=True).sum()
+    mask = np.ones(len(df), dtype=bool)
+    for col, op, value in FILTERS:
+        mask &= (df[col] >= value).to_numpy()
+    return df[mask], loaded_bytes
+
+def query(storage, db_ids):
+    df = storage.query_many(db_ids, COLUMNS, FILTERS)
+    return df, df.memory_usage(deep=True).sum()
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = ParquetStorage(tmp_dir, 'zstd')
+        db_ids = ['db_%d' % i for i in range(max(DATASET_COUNTS))]
+        for i, db_id in enumerate(db_ids):
+            storage.write(db_id, make_dataset(i, ROWS_PER_DATASET))
+
+        print('%10s %10s %15s %17s %10s %15s' % ('datasets', 'rows', 'load+mask (s)', 'loaded (MB)', 'query (s)', 'loaded (MB)'))
+        for count in DATASET_COUNTS:
+            selected = db_ids[:count]
+            old_time, (old_df, old_bytes) = timed(load_and_filter, storage, selected)
+            new_time, (new_df, new_bytes) = timed(query, storage, selected)
+            assert len(old_df) == len(new_df)
+            print('%10d %10d %15.2f %17.1f %10.2f %15.1f' % (count, len(new_df), old_time, old_bytes / 1e6,
+                                                           new_time, new_bytes / 1e6))
@@ -0,0 +1,44 @@
+"""
+    Benchmark of the startup time of the app: the time to import app.py and the modules it
+    builds on, each in a new interpreter with network connections disabled, so the startup is
+    also checked to work offline.
+    Run from the dash directory: python benchmarks/bench_startup.py
+"""
+import os
+import subprocess
+import sys
+
+MODULES = ['settings', 'db_engine', 'data_analysis', 'jobs', 'app']
+REPEAT = 5
+
+# imports a module in a new interpreter where opening a network connection raises an error
+IMPORT_SCRIPT = '''
+import socket
+import time
+
+def no_network(*args, **kwargs):
+    raise OSError('network access during startup')
+
+socket.socket.connect = no_network
+socket.create_connection = no_network
+start = time.perf_counter()
+import %s
+print(time.perf_counter() - start)
+'''
+
+def import_time(module):
+    dash_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT % module], cwd=dash_dir,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1][:100])
+    return float(result.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    print('%-15s %14s' % ('module', 'import (s)'))
+    for module in MODULES:
+        try:
+            times = [import_time(module) for i in range(REPEAT)]
+            print('%-15s %14.3f' % (module, min(times)))
+        except RuntimeError as e:
+            print('%-15s %14s  %s' % (module, 'failed', e))
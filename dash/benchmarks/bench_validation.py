@@ -0,0 +1,64 @@
+"""
+    Benchmark of the data checks of validation.py on uploads of 10,000 to 1,000,000 rows in the GLEON
+    template, with a few percent of detection limits, out of range values, bad coordinates and duplicates.
+    Reports the time of the checks alone and the number of values in the violation report.
+    Run from the dash directory: python benchmarks/bench_validation.py
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_engine import SOURCE_NAMES, coerce_columns, add_date_fields
+from validation import Validator
+
+ROW_COUNTS = [10000, 100000, 1000000]
+CHUNK_ROWS = 50000
+ANALYTES = ['TP_mgL', 'TN_mgL', 'Chlorophylla_ugL', 'TotalMC_ug/L', 'DissolvedMC_ugL', 'SecchiDepth_m', 'PercentCyano']
+
+def make_upload(n_rows):
+    rng = np.random.RandomState(0)
+    lat = rng.uniform(40, 60, n_rows)
+    lat[rng.uniform(size=n_rows) < 0.01] = 0
+    lon = rng.uniform(-120, -80, n_rows)
+    lon[rng.uniform(size=n_rows) < 0.01] = 0
+    df = pd.DataFrame({
+        'Date': pd.Timestamp('2005-01-01') + pd.to_timedelta(rng.randint(0, 5000, n_rows), unit='D'),
+        'LakeName': ['Lake %d' % i for i in rng.randint(0, 200, n_rows)],
+        'Lat': lat,
+        'Long': lon,
+        'SamplingDepth_m': rng.randint(0, 5, n_rows).astype(float),
+    })
+    for col in ANALYTES:
+        values = rng.lognormal(0, 1, n_rows).round(3)
+        values[rng.uniform(size=n_rows) < 0.01] *= -1
+        values = values.astype(object)
+        values[rng.uniform(size=n_rows) < 0.02] = '<0.05'
+        df[col] = values
+    return df
+
+def validate(upload):
+    """
+        Seconds spent in the checks of the validator, and the number of values it reported
+    """
+    validator = Validator()
+    seconds = 0
+    for start in range(0, len(upload), CHUNK_ROWS):
+        chunk = upload.iloc[start:start + CHUNK_ROWS].rename(columns=SOURCE_NAMES)
+        started = time.perf_counter()
+        chunk = validator.parse_detection_limits(chunk)
+        seconds += time.perf_counter() - started
+        chunk, errors = coerce_columns(chunk)
+        chunk = add_date_fields(chunk)
+        started = time.perf_counter()
+        validator.check(chunk)
+        seconds += time.perf_counter() - started
+    return seconds, sum(validator.counts.values())
+
+if __name__ == '__main__':
+    print('%10s %12s %12s' % ('rows', 'time (s)', 'violations'))
+    for n_rows in ROW_COUNTS:
+        seconds, n_violations = validate(make_upload(n_rows))
+        print('%10d %12.2f %12d' % (n_rows, seconds, n_violations))
@@ -0,0 +1,199 @@
+"""
+    Content hashes of the uploaded files and of the stored databases. A file is hashed by its bytes
+    as it is received. The rows of a database are hashed by their values, independently of the order
+    of the rows and of the columns, of the column types and of the data files they are stored in, so
+    identical data is recognized however it was uploaded or appended. The hash of a set of rows is
+    the number of rows and two sums of their 64-bit hashes, so the hashes of the data files of a
+    database add up to the hash of the database, and the hash of removed rows is subtracted.
+    Each file hash is saved next to its file, so adding rows to a database only hashes the files that
+    the new rows changed.
+"""
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from dtype_optimizer import FLOAT32_DIGITS, NULLABLE_TYPES
+
+# files are read and hashed this many bytes at a time
+FILE_BLOCK_BYTES = 1024 * 1024
+# rows of a data file are converted and hashed this many at a time
+HASH_BATCH_ROWS = 100000
+# the content hash of a data file is saved in a file with this suffix next to it
+HASH_SUFFIX = '.hash'
+# numbers are hashed rounded to this many significant digits, so a value that was converted
+# (ex. a unit conversion) or stored as float32 in one file and float64 in another has the same hash
+HASH_DIGITS = 12
+# the sums of the row hashes are kept modulo 2 ** 64
+HASH_MASK = 2 ** 64 - 1
+# the second sum adds up the row hashes mixed again with this key, so the two sums are independent
+SECOND_SUM_KEY = np.uint64(0x9e3779b97f4a7c15)
+
+class ContentHash:
+    """
+        Hash of a set of rows, whatever their order: the number of rows and two sums modulo 2 ** 64
+        of the 64-bit hashes of the rows. Hashes of separate sets of rows are merged by adding them up,
+        and the hash of rows removed from a set is subtracted from the hash of the set.
+    """
+    def __init__(self, num_rows=0, first_sum=0, second_sum=0):
+        self.num_rows = num_rows
+        self.first_sum = first_sum
+        self.second_sum = second_sum
+
+    @classmethod
+    def from_row_hashes(cls, row_hashes):
+        # numpy sums of uint64 wrap around, which is the sum modulo 2 ** 64
+        return cls(len(row_hashes), int(row_hashes.sum(dtype=np.uint64)),
+                   int(mix(row_hashes ^ SECOND_SUM_KEY).sum(dtype=np.uint64)))
+
+    @classmethod
+    def from_string(cls, text):
+        """
+            Hash saved by to_string. Raises ValueError for text in any other format.
+        """
+        num_rows, first_sum, second_sum = text.split(':')
+        return cls(int(num_rows), int(first_sum, 16), int(second_sum, 16))
+
+    def to_string(self):
+        return '%d:%016x:%016x' % (self.num_rows, self.first_sum, self.second_sum)
+
+    def merge(self, other):
+        self.num_rows += other.num_rows
+        self.first_sum = (self.first_sum + other.first_sum) & HASH_MASK
+        self.second_sum = (self.second_sum + other.second_sum) & HASH_MASK
+
+    def remove(self, other):
+        self.num_rows -= other.num_rows
+        self.first_sum = (self.first_sum - other.first_sum) & HASH_MASK
+        self.second_sum = (self.second_sum - other.second_sum) & HASH_MASK
+
+    def hexdigest(self):
+        """
+            SHA-256 hex digest of the hash, saved in the Content_hash column of the metadata registry
+        """
+        return hashlib.sha256(self.to_string().encode('ascii')).hexdigest()
+
+def hash_stream(stream, target=None):
+    """
+        SHA-256 hex digest of the bytes of a stream, also copied into the target file if one is given
+    """
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(FILE_BLOCK_BYTES), b''):
+        digest.update(block)
+        if target is not None:
+            target.write(block)
+    return digest.hexdigest()
+
+def mix(values):
+    """
+        SplitMix64 finalizer of an array of 64-bit values, so that sums of hashes do not cancel out
+    """
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+def get_column_key(col):
+    return np.uint64(int.from_bytes(hashlib.sha256(col.encode('utf-8')).digest()[:8], 'little'))
+
+def round_significant(values, digits):
+    """
+        Float64 values rounded to the given number of significant digits. The powers of ten up to
+        10 ** 22 are exact, so a value is rounded to the nearest float64 of its decimal form.
+    """
+    values = values.copy()
+    rounded = np.isfinite(values) & (values != 0)
+    exponents = digits - 1 - np.floor(np.log10(np.abs(values[rounded])))
+    scales = 10.0 ** np.abs(exponents)
+    values[rounded] = np.where(exponents >= 0, np.round(values[rounded] * scales) / scales,
+                               np.round(values[rounded] / scales) * scales)
+    # -0.0 is hashed as 0.0
+    return values + 0.0
+
+def hash_cells(series, col):
+    """
+        64-bit hash of each value of a column together with the column name, or 0 for a missing value.
+        Numbers are hashed as float64 rounded to HASH_DIGITS significant digits (float32 columns to
+        FLOAT32_DIGITS first, the digits they were written with), dates as nanoseconds and other values as text.
+    """
+    valid = series.notnull().to_numpy()
+    values = series[valid]
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        values = values.astype('datetime64[ns]').to_numpy().view(np.int64)
+    elif pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        numbers = values.to_numpy(dtype=np.float64)
+        if values.dtype == np.float32:
+            numbers = round_significant(numbers, FLOAT32_DIGITS)
+        values = round_significant(numbers, HASH_DIGITS)
+    else:
+        values = values.astype(str).to_numpy(dtype=object)
+    cells = np.zeros(len(series), dtype=np.uint64)
+    cells[valid] = mix(pd.util.hash_array(values, categorize=False) ^ get_column_key(col))
+    return cells
+
+def hash_rows(df):
+    """
+        64-bit hash of each row of a dataframe from its column names and values. Missing values are
+        left out, so a row has the same hash in a file without the columns that are empty for it.
+    """
+    row_sums = np.zeros(len(df), dtype=np.uint64)
+    for col in df.columns:
+        row_sums += hash_cells(df[col], str(col))
+    return mix(row_sums)
+
+def hash_batches(batches):
+    """
+        Content hash of the rows of Arrow record batches. The batches are loaded with the types of
+        db_engine.to_dataframe, and only the 64-bit hash of each row is kept.
+    """
+    file_hash = ContentHash()
+    for batch in batches:
+        file_hash.merge(ContentHash.from_row_hashes(hash_rows(batch.to_pandas(types_mapper=NULLABLE_TYPES.get))))
+    return file_hash
+
+def hash_file(path):
+    """
+        Content hash of the rows of a Parquet data file, read one batch of rows at a time,
+        so the data of the file is never loaded whole
+    """
+    return hash_batches(pq.ParquetFile(path).iter_batches(batch_size=HASH_BATCH_ROWS))
+
+def combine_hashes(file_hashes):
+    """
+        Content hash of the rows of several data files
+    """
+    combined = ContentHash()
+    for file_hash in file_hashes:
+        combined.merge(file_hash)
+    return combined
+
+def get_file_hash(path):
+    """
+        Content hash of a data file, read from the hash file saved next to it. The hash is computed
+        (and saved) again only if the data file has changed since, so adding a part file to a database
+        does not read its other files again.
+    """
+    try:
+        with open(path + HASH_SUFFIX) as saved:
+            signature, file_hash = saved.read().split()
+        if signature == get_signature(path):
+            return ContentHash.from_string(file_hash)
+    except (FileNotFoundError, ValueError):
+        pass
+    file_hash = hash_file(path)
+    save_file_hash(path, file_hash)
+    return file_hash
+
+def save_file_hash(path, file_hash):
+    """
+        Save the content hash of a data file next to it, with the size and modification time of the file
+    """
+    tmp_path = path + HASH_SUFFIX + '.tmp'
+    with open(tmp_path, 'w') as saved:
+        saved.write('%s %s\n' % (get_signature(path), file_hash.to_string()))
+    os.replace(tmp_path, path + HASH_SUFFIX)
+
+def get_signature(path):
+    stat = os.stat(path)
+    return '%d:%d' % (stat.st_size, stat.st_mtime_ns)
@@ -2,16 +2,55 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objs as go
 import re
-from settings import months, USEPA_LIMIT, WHO_LIMIT 
-
-
-def geo_log_plot(selected_data, current_df):
+from settings import months, USEPA_LIMIT, WHO_LIMIT, GEO_VIEWPORT_MARGIN, GEO_CLUSTER_MIN_POINTS, GEO_CLUSTER_CELL_DEGREES, PLOT_POINT_BUDGET, \
+    WEBGL_MODE, WEBGL_POINT_THRESHOLD
+from spatial_index import cluster_samples
+from downsample import downsample
+import db_engine as db
+
+GEO_HOVER_TEMPLATE = '%{text}<br>%{lat:.3f}, %{lon:.3f}'
+TN_TP_COLUMNS = ["Total Nitrogen (ug/L)", "Total Phosphorus (ug/L)", "Microcystin (ug/L)", "Body of Water Name"]
+TN_TP_HOVER_TEMPLATE = '%{text}<br>log TN: %{x:.2f}<br>log TP: %{y:.2f}'
+
+
+def scatter_type(n_points):
+    '''
+        WebGL scatter trace type for graphs with more points than SVG can draw smoothly, SVG scatter otherwise
+    '''
+    if WEBGL_MODE == 'always' or (WEBGL_MODE == 'auto' and n_points > WEBGL_POINT_THRESHOLD):
+        return go.Scattergl
+    return go.Scatter
+
+def hover_fields(subset, template):
+    '''
+        Hover text and template for a trace drawn from the rows in subset. The text holds the lake
+        names of those rows only, looked up once per lake from the category codes, and the labels
+        and values around it are formatted in the browser by the template (%{text} is the lake name).
+    '''
+    names = subset["Body of Water Name"]
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        lakes = names.cat.categories.astype(str).to_numpy(dtype=object)
+        codes = names.cat.codes.to_numpy()
+        text = np.where(codes >= 0, lakes[codes], '')
+    else:
+        text = names.fillna('').astype(str).to_numpy(dtype=object)
+    return dict(text=text, hovertemplate=template)
+
+def plot_values(column):
+    '''
+        Values of a column for a graph trace, with the nullable integer counts as floats (NaN where missing)
+    '''
+    if pd.api.types.is_extension_array_dtype(column) and pd.api.types.is_numeric_dtype(column):
+        return column.astype(float)
+    return column
+
+def geo_log_plot(selected_data):
     selected_data["MC_pc_bin"] = np.log(np.abs(selected_data["MC Percent Change"]) + 1)
     data = [go.Scattergeo(
         lon = selected_data['LONG'],
         lat = selected_data['LAT'],
         mode = 'markers',
-        text = current_df["Body of Water Name"],
+        **hover_fields(selected_data, GEO_HOVER_TEMPLATE),
         visible = True,
         #name = "MC > WHO Limit",
         marker = dict(
@@ -34,6 +73,8 @@ def geo_log_plot(selected_data, current_df):
 
     layout = go.Layout(title='Log Microcystin Concentration Change',
                         showlegend=False,
+                        # keep the user's zoom and pan when the points are updated
+                        uirevision='geo',
                         geo = dict(
                                 scope='world',
                                 showframe = False,
@@ -59,7 +100,7 @@ def geo_concentration_plot(selected_data):
             lon = b1['LONG'],
             lat = b1['LAT'],
             mode = 'markers',
-            text = b1["Body of Water Name"],
+            **hover_fields(b1, GEO_HOVER_TEMPLATE),
             visible = True,
             name = "MC <= USEPA Limit",
             marker=dict(color="green",opacity = opacity_level)))
@@ -67,7 +108,7 @@ def geo_concentration_plot(selected_data):
             lon = b2['LONG'],
             lat = b2['LAT'],
             mode = 'markers',
-            text = b2["Body of Water Name"],
+            **hover_fields(b2, GEO_HOVER_TEMPLATE),
             visible = True,
             name = "MC <= WHO Limit",
             marker=dict(color="orange",opacity = opacity_level)))
@@ -75,7 +116,7 @@ def geo_concentration_plot(selected_data):
             lon = b3['LONG'],
             lat = b3['LAT'],
             mode = 'markers',
-            text = b3["Body of Water Name"],
+            **hover_fields(b3, GEO_HOVER_TEMPLATE),
             visible = True,
             name = "MC > WHO Limit",
             marker=dict(color="red",opacity = opacity_level)))
@@ -83,6 +124,7 @@ def geo_concentration_plot(selected_data):
     layout = go.Layout(showlegend=True,
                         hovermode='closest',
                         title="Microcystin Concentration",
+                        uirevision='geo',
                         geo = dict(
                                 scope='world',
                                 showframe = False,
@@ -96,17 +138,94 @@ def geo_concentration_plot(selected_data):
     fig = go.Figure(layout=layout, data=data)  
     return fig
 
-def geo_plot(selected_years, selected_month, geo_option, current_df):
+def geo_cluster_plot(selected_data, scale):
+    '''
+        Concentration map with the samples grouped into grid clusters sized for the zoom scale.
+        Each cluster is colored by its largest concentration, sized by its number of samples,
+        and its hover text gives the fraction of samples above the USEPA and WHO limits.
+    '''
+    clusters = cluster_samples(selected_data['LAT'], selected_data['LONG'], selected_data['Microcystin (ug/L)'],
+                               GEO_CLUSTER_CELL_DEGREES / scale, {'USEPA': USEPA_LIMIT, 'WHO': WHO_LIMIT})
+    clusters['text'] = ['%d samples<br>Max MC: %.2f ug/L<br>%.0f%% > USEPA, %.0f%% > WHO' %
+                        (count, max_mc, usepa * 100, who * 100) for count, max_mc, usepa, who in
+                        zip(clusters['Count'], clusters['Max'], clusters['Fraction > USEPA'].fillna(0), clusters['Fraction > WHO'].fillna(0))]
+    # make bins on the largest concentration of each cluster
+    max_conc = clusters['Max'].fillna(0)
+    bins = [(clusters[max_conc <= USEPA_LIMIT], "MC <= USEPA Limit", "green"),
+            (clusters[(max_conc > USEPA_LIMIT) & (max_conc <= WHO_LIMIT)], "MC <= WHO Limit", "orange"),
+            (clusters[max_conc > WHO_LIMIT], "MC > WHO Limit", "red")]
+    data = []
+    for b, name, color in bins:
+        data.append(go.Scattergeo(
+                lon = b['LONG'],
+                lat = b['LAT'],
+                mode = 'markers',
+                text = b['text'],
+                hoverinfo = 'text',
+                visible = True,
+                name = name,
+                marker=dict(color=color, opacity=0.8, size=6 + 4 * np.log10(b['Count']))))
+
+    layout = go.Layout(showlegend=True,
+                        hovermode='closest',
+                        title="Microcystin Concentration (grouped by area, zoom in to see individual samples)",
+                        uirevision='geo',
+                        geo = dict(
+                                scope='world',
+                                showframe = False,
+                                showcoastlines = True,
+                                showlakes = True,
+                                showland = True,
+                                landcolor = "rgb(229, 229, 229)",
+                                showrivers = True
+                            ))
+
+    fig = go.Figure(layout=layout, data=data)
+    return fig
+
+def get_geo_scale(relayout_data):
+    '''
+        Zoom scale of the geo graph from its last zoom, 1 when fully zoomed out
+    '''
+    if not relayout_data:
+        return 1
+    return max(relayout_data.get('geo.projection.scale', 1), 1)
+
+def get_geo_viewport(relayout_data):
+    '''
+        Bounding box (lat_min, lat_max, lon_min, lon_max) of the visible part of the world map
+        from the last zoom or pan of the geo graph, or None when the whole map is visible
+    '''
+    if not relayout_data:
+        return None
+    scale = relayout_data.get('geo.projection.scale', 1)
+    if scale <= 1:
+        return None
+    center_lon = relayout_data.get('geo.center.lon', relayout_data.get('geo.projection.rotation.lon', 0))
+    center_lat = relayout_data.get('geo.center.lat', 0)
+    half_lat = 90 / scale * GEO_VIEWPORT_MARGIN
+    half_lon = 180 / scale * GEO_VIEWPORT_MARGIN
+    if half_lon >= 180:
+        return (center_lat - half_lat, center_lat + half_lat, -180, 180)
+    wrap = lambda lon: (lon + 180) % 360 - 180
+    return (center_lat - half_lat, center_lat + half_lat, wrap(center_lon - half_lon), wrap(center_lon + half_lon))
+
+def geo_plot(selected_years, selected_month, geo_option, current_df, spatial_index=None, viewport=None, scale=1):
     if type(selected_years) is not list:
         selected_years = [selected_years]
 
-    month = pd.to_datetime(current_df['DATETIME']).dt.month
-    year = pd.to_datetime(current_df['DATETIME']).dt.year
-    selected_data = current_df[(month.isin(selected_month)) & (year.isin(selected_years))]
+    # only send the points in the visible part of the map
+    if spatial_index is not None and viewport is not None:
+        current_df = current_df.iloc[spatial_index.query_bbox(*viewport)]
+
+    selected_data = current_df[(current_df['Month'].isin(selected_month)) & (current_df['Year'].isin(selected_years))]
     if geo_option == "CONC":
+        # too many samples to draw one by one, group them until the user zooms in far enough
+        if len(selected_data) > GEO_CLUSTER_MIN_POINTS:
+            return geo_cluster_plot(selected_data, scale)
         return geo_concentration_plot(selected_data)
     else:
-        return geo_log_plot(selected_data, current_df)
+        return geo_log_plot(selected_data)
 
 def tn_tp(tn_val, tp_val, current_df):
     min_tn = tn_val[0]
@@ -121,38 +240,65 @@ def tn_tp(tn_val, tp_val, current_df):
         max_tp = np.max(current_df["Total Phosphorus (ug/L)"])
 
     dat = current_df[(current_df["Total Nitrogen (ug/L)"] >= min_tn) & (current_df["Total Nitrogen (ug/L)"] <= max_tn) & (current_df["Total Phosphorus (ug/L)"] >= min_tp) & (current_df["Total Phosphorus (ug/L)"] <= max_tp)]
+    return tn_tp_plot(dat)
+
+def tn_tp_query(tn_val, tp_val, db_ids):
+    '''
+        TN vs TP graph of the selected databases, with the range filters run on the stored files
+        by the query engine of db_engine instead of on the loaded selection
+    '''
+    min_tn = tn_val[0]
+    max_tn = tn_val[1]
+    min_tp = tp_val[0]
+    max_tp = tp_val[1]
+
+    if max_tn == 0:
+        max_tn = db.get_column_stats(db_ids, "Total Nitrogen (ug/L)").max
+
+    if max_tp == 0:
+        max_tp = db.get_column_stats(db_ids, "Total Phosphorus (ug/L)").max
+
+    dat = db.query(db_ids, TN_TP_COLUMNS, [("Total Nitrogen (ug/L)", '>=', min_tn), ("Total Nitrogen (ug/L)", '<=', max_tn),
+                                          ("Total Phosphorus (ug/L)", '>=', min_tp), ("Total Phosphorus (ug/L)", '<=', max_tp)])
+    return tn_tp_plot(dat)
+
+def tn_tp_plot(dat):
+    '''
+        TN vs TP graph of the samples in dat, colored by their microcystin concentration
+    '''
     MC_conc = dat['Microcystin (ug/L)']
     # make bins
     b1 = dat[MC_conc <= USEPA_LIMIT]
     b2 = dat[(MC_conc > USEPA_LIMIT) & (MC_conc <= WHO_LIMIT)]
     b3 = dat[MC_conc > WHO_LIMIT]
+    Scatter = scatter_type(len(dat))
 
-    data = [go.Scatter(
+    data = [Scatter(
         x=np.log(b1["Total Nitrogen (ug/L)"]),
         y=np.log(b1["Total Phosphorus (ug/L)"]),
         mode = 'markers',
         name="<USEPA",
-        text=current_df["Body of Water Name"],
+        **hover_fields(b1, TN_TP_HOVER_TEMPLATE),
         marker=dict(
             size=8,
             color = "green", #set color equal to a variable
         )),
-        go.Scatter(
+        Scatter(
         x=np.log(b2["Total Nitrogen (ug/L)"]),
         y=np.log(b2["Total Phosphorus (ug/L)"]),
         mode = 'markers',
         name=">USEPA",
-        text=current_df["Body of Water Name"],
+        **hover_fields(b2, TN_TP_HOVER_TEMPLATE),
         marker=dict(
             size=8,
             color = "orange" #set color equal to a variable
         )),
-        go.Scatter(
+        Scatter(
         x=np.log(b3["Total Nitrogen (ug/L)"]),
         y=np.log(b3["Total Phosphorus (ug/L)"]),
         mode = 'markers',
         name=">WHO",
-        text=current_df["Body of Water Name"],
+        **hover_fields(b3, TN_TP_HOVER_TEMPLATE),
         marker=dict(
             size=8,
             color = "red", #set color equal to a variable
@@ -201,10 +347,10 @@ def correlation_plot(selected_dataset, current_df):
 def comparison_plot(selected_y, selected_x, current_df):
     selected_data = current_df[[selected_y, selected_x]]
 
-    x_data = selected_data[selected_x]
-    y_data = selected_data[selected_y]
+    x_data = plot_values(selected_data[selected_x])
+    y_data = plot_values(selected_data[selected_y])
 
-    data = go.Scatter(
+    data = scatter_type(len(selected_data))(
         x=x_data,
         y=y_data, 
         mode='markers')
@@ -222,18 +368,21 @@ def comparison_plot(selected_y, selected_x, current_df):
     }
     return comparison_plot
 
-def temporal_lake(selected_col, selected_loc, selected_type, current_df):
+def temporal_lake(selected_col, selected_type, lake_data, x_range=None, uirevision=None):
+    '''
+        Values of a column for the samples of one lake, or their percent change from sample to sample.
+        lake_data holds the samples of the lake in date order. The zoom of the graph is kept while
+        uirevision stays the same, and reset when it changes.
+    '''
     selected_col_stripped = re.sub("[\(\[].*?[\)\]]", "", selected_col)
     selected_col_stripped = re.sub('\s+', ' ', selected_col_stripped).strip()
  
-    selected_data = current_df[current_df['Body of Water Name'] == selected_loc]
-    x_data=pd.to_datetime(selected_data['DATETIME'])
-    print(len(selected_data[selected_col]))
+    selected_data = lake_data
+    x_data=selected_data['DATETIME']
     
     if len(selected_data[selected_col]) >= 3:
         if selected_type=='raw':
             y_data=selected_data[selected_col]
-            print(len(y_data))
             title = '%s Trends' % (selected_col_stripped)
             y_axis = str(selected_col)
         else:
@@ -242,6 +391,7 @@ def temporal_lake(selected_col, selected_loc, selected_type, current_df):
             y_axis = 'Percent Change in %s' % (selected_col_stripped)
     else:
         title = ''
+        x_data = []
         y_data = []
         y_axis = ''
     
@@ -249,27 +399,29 @@ def temporal_lake(selected_col, selected_loc, selected_type, current_df):
         title= title, 
         xaxis={'title':'Date'},
         yaxis={'title': y_axis},
-        hovermode='closest'
+        hovermode='closest',
+        uirevision=uirevision
     )
-    temporal_lake_plot = plot_line(x_data, y_data, layout)
+    temporal_lake_plot = plot_line(x_data, y_data, layout, x_range)
 
     return temporal_lake_plot
 
-def temporal_overall(selected_col, selected_type, current_df):
+def temporal_overall(selected_col, selected_type, monthly_cube):
+    '''
+        Monthly mean of a column, or its percent change from month to month, read from the
+        monthly aggregates of the selected dataset
+    '''
     selected_col_stripped = re.sub("[\(\[].*?[\)\]]", "", selected_col)
     selected_col_stripped = re.sub('\s+', ' ', selected_col_stripped).strip()
-    selected_data = current_df[['DATETIME', selected_col]]
-    months = pd.to_datetime(selected_data['DATETIME']).dt.to_period("M")
-    selected_data_month = selected_data.groupby(months)
-    selected_data_month = selected_data_month.agg(['mean'])
-    x_data=selected_data_month.index.to_timestamp()
+    monthly_mean = monthly_cube[(selected_col, 'mean')]
+    x_data = monthly_mean.index
     
     if selected_type=='avg':
-        y_data=selected_data_month[selected_col]['mean']
+        y_data=monthly_mean
         title = '%s vs Date' %selected_col_stripped
         y_axis = str(selected_col)
     else:
-        y_data=selected_data_month[selected_col]['mean'].pct_change()
+        y_data=monthly_mean.pct_change()
         title = 'Percent Change of %s vs Date' %selected_col_stripped
         y_axis = 'Percent Change of %s' %selected_col_stripped
 
@@ -283,7 +435,21 @@ def temporal_overall(selected_col, selected_type, current_df):
     
     return temporal_overall_plot
 
-def temporal_raw(selected_option, selected_col, log_range, current_df):
+def get_x_range(relayout_data):
+    '''
+        Range (start, end) of the date axis after the user zoomed into a graph, or None for the whole range
+    '''
+    if not relayout_data:
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        x_range = [relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']]
+    elif 'xaxis.range' in relayout_data:
+        x_range = relayout_data['xaxis.range']
+    else:
+        return None
+    return pd.Timestamp(x_range[0]), pd.Timestamp(x_range[1])
+
+def temporal_raw(selected_option, selected_col, log_range, current_df, x_range=None, uirevision=None):
 
     min_log = log_range[0]
     max_log = log_range[1]
@@ -292,30 +458,72 @@ def temporal_raw(selected_option, selected_col, log_range, current_df):
         max_log = np.max(current_df[selected_col])
 
     dat = current_df[(current_df[selected_col] >= min_log) & (current_df[selected_col] <= max_log)]
-    MC_conc = dat['Microcystin (ug/L)']
+    
+    if selected_option == '3SD':
+        dat = dat[((dat[selected_col] - current_df[selected_col].mean()) / current_df[selected_col].std()).abs() < 3]
+
+    # only the zoomed in dates are drawn, downsampled to the point budget of the graph
+    dat = dat.sort_values('DATETIME', kind='mergesort')
+    if x_range is not None:
+        dat = dat[(dat['DATETIME'] >= x_range[0]) & (dat['DATETIME'] <= x_range[1])]
+    return temporal_raw_plot(selected_option, selected_col, dat, uirevision)
+
+def temporal_raw_query(selected_option, selected_col, log_range, db_ids, x_range=None, uirevision=None):
+    '''
+        Raw data graph of the selected databases, with the range, outlier and date filters run on the
+        stored files by the query engine of db_engine. selected_col must be a stored column.
+    '''
+    min_log = log_range[0]
+    max_log = log_range[1]
 
+    if max_log == 0 or selected_option == '3SD':
+        stats = db.get_column_stats(db_ids, selected_col)
+    if max_log == 0:
+        max_log = stats.max
+
+    filters = [(selected_col, '>=', min_log), (selected_col, '<=', max_log)]
+    if selected_option == '3SD':
+        # within 3 standard deviations of the mean of the whole selection
+        filters += [(selected_col, '>', stats.mean - 3 * stats.std), (selected_col, '<', stats.mean + 3 * stats.std)]
+    if x_range is not None:
+        filters += [('DATETIME', '>=', x_range[0]), ('DATETIME', '<=', x_range[1])]
+
+    columns = ['DATETIME', 'Body of Water Name', 'Microcystin (ug/L)', selected_col]
+    dat = db.query(db_ids, list(dict.fromkeys(columns)), filters)
+    dat = dat.sort_values('DATETIME', kind='mergesort')
+    return temporal_raw_plot(selected_option, selected_col, dat, uirevision)
+
+def temporal_raw_plot(selected_option, selected_col, dat, uirevision=None):
+    '''
+        Scatter plot of the microcystin concentration of the samples in dat, sorted by date,
+        downsampled to the point budget of the graph. The zoom is kept while uirevision stays the same.
+    '''
     selected_col_stripped = re.sub("[\(\[].*?[\)\]]", "", selected_col)
     selected_col_stripped = re.sub('\s+', ' ', selected_col_stripped).strip()
-    selected_data = current_df[['DATETIME', selected_col]]
-    
-    if selected_option == '3SD':
-        selected_data = selected_data[((selected_data[selected_col] - selected_data[selected_col].mean()) / selected_data[selected_col].std()).abs() < 3]
-    x_data = selected_data['DATETIME']
-    y_data = MC_conc
+
+    # the points are the microcystin concentrations of the samples whose selected_col is in range
+    MC_conc = dat['Microcystin (ug/L)']
+    y_label = 'Microcystin (ug/L)'
     if selected_option == 'LOG':
-        y_data = np.log(MC_conc)
+        MC_conc = np.log(MC_conc)
+        y_label = 'log Microcystin (ug/L)'
+    kept = downsample(dat['DATETIME'], MC_conc, PLOT_POINT_BUDGET, 'minmax')
+    dat = dat.iloc[kept]
+    x_data = dat['DATETIME']
+    y_data = MC_conc.iloc[kept]
 
     layout = go.Layout(
         title= '%s vs Date' %selected_col_stripped, 
         xaxis={'title':'Date'},
-        yaxis={'title': str(selected_col)},
-        hovermode='closest'
+        yaxis={'title': y_label},
+        hovermode='closest',
+        uirevision=uirevision
     )
     
-    data = go.Scatter(
+    data = scatter_type(len(dat))(
         x=x_data,
         y=y_data,
-        text= "Lake: " + current_df["Body of Water Name"],
+        **hover_fields(dat, 'Lake: %{text}<br>%{x}<br>' + y_label + ': %{y:.2f}'),
         mode='markers',
         marker={
            'opacity': 0.8,
@@ -331,10 +539,21 @@ def temporal_raw(selected_option, selected_col, log_range, current_df):
     } 
     return temporal_raw_plot
 
-def plot_line(x_data, y_data, layout):
+def plot_line(x_data, y_data, layout, x_range=None):
+    '''
+        Line graph of a series sorted by date, limited to the zoomed in dates and downsampled to the point budget
+    '''
+    x_data = pd.Series(x_data)
+    y_data = plot_values(pd.Series(y_data))
+    if x_range is not None:
+        in_range = ((x_data >= x_range[0]) & (x_data <= x_range[1])).to_numpy()
+        x_data = x_data[in_range]
+        y_data = y_data[in_range]
+    kept = downsample(x_data, y_data, PLOT_POINT_BUDGET, 'lttb')
+
     data = go.Scatter(
-        x=x_data,
-        y=y_data,
+        x=x_data.iloc[kept],
+        y=y_data.iloc[kept],
         mode='lines',
         marker={
            'opacity': 0.8,
@@ -347,4 +566,4 @@ def plot_line(x_data, y_data, layout):
         'data': [data],
         'layout': layout
     } 
-    return fig
\ No newline at end of file
+    return fig
@@ -0,0 +1,56 @@
+"""
+    Merged data of a selection of databases together with the indexes built over it
+"""
+import threading
+import numpy as np
+from aggregates import monthly_cube
+from lake_index import LakeIndex
+from spatial_index import SpatialIndex
+from settings import SPATIAL_CELL_DEGREES
+
+class Dataset:
+    """
+        Built once per selection when it is materialized, and shared by all the callbacks of that selection
+    """
+    def __init__(self, df):
+        self.df = df
+        self.spatial_index = SpatialIndex(self.get_column('LAT'), self.get_column('LONG'), SPATIAL_CELL_DEGREES)
+        self.lake_index = LakeIndex(self.get_column('Body of Water Name'), self.get_column('DATETIME'))
+        self._monthly_cubes = {}
+        self._lake_data = None
+        self._lock = threading.Lock()
+
+    def get_column(self, col):
+        if col in self.df.columns:
+            return self.df[col]
+        return np.full(len(self.df), np.nan)
+
+    def get_monthly_cube(self, by=()):
+        """
+            Monthly aggregates of the numeric columns (see aggregates.monthly_cube), optionally also
+            grouped by the columns in by. Each cube is computed the first time it is needed.
+        """
+        by = tuple(by)
+        with self._lock:
+            if by not in self._monthly_cubes:
+                self._monthly_cubes[by] = monthly_cube(self.df, by)
+            return self._monthly_cubes[by]
+
+    def get_lake_data(self, lake):
+        """
+            Samples of a lake in date order. The last lake is kept, so the graphs of the same lake
+            share one slice.
+        """
+        with self._lock:
+            if self._lake_data is None or self._lake_data[0] != lake:
+                self._lake_data = (lake, self.df.iloc[self.lake_index.get_positions(lake)])
+            return self._lake_data[1]
+
+    def memory_usage(self):
+        """
+            Approximate size in bytes of the dataframe and its indexes
+        """
+        index = self.spatial_index
+        lake_index = self.lake_index
+        return (int(self.df.memory_usage(deep=True).sum()) + index.positions.nbytes + index.cells.nbytes +
+                lake_index.positions.nbytes + lake_index.offsets.nbytes)
@@ -1,189 +1,1053 @@
-import base64
+import collections
 import datetime
-import io
+import glob
+import os
+import shutil
+import threading
+import time
+import uuid
 import pandas as pd
 import numpy as np
-from settings import metadataDB
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from settings import METADATA_PATH, METADATA_DB_PATH, DATA_DIR, STORAGE_COMPRESSION, LOADER_THREADS, CACHE_MAX_BYTES, CACHE_TTL_SECONDS, \
+    SHARED_CACHE_DIR, SHARED_CACHE_MAX_BYTES, DOWNLOAD_CHUNK_ROWS
+from df_cache import DataFrameCache
+from shared_cache import SharedFrameStore
+from metadata_registry import MetadataRegistry
+from dataset import Dataset
+from dtype_optimizer import DtypeProfile, NULLABLE_TYPES, format_bytes
+from schema import SOURCE_NAMES, DERIVED_COLUMNS, ROW_KEY_COLUMNS, coerce_columns
+from validation import Validator
+import content_hash
+import ingest
 
-def upload_new_database(new_dbinfo, contents, filename):
+try:
+    import fcntl
+except ImportError:
+    # Windows has no file locks, the databases are then locked within the process only
+    fcntl = None
+
+class ParquetStorage:
     """
-        Decode contents of the upload component and create a new dataframe 
+        Columnar storage of the uploaded databases: one compressed Parquet file per database,
+        followed by the part files of the rows appended to it since it was uploaded
     """
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
+    def __init__(self, data_dir, compression):
+        self.data_dir = data_dir
+        self.compression = compression
 
-    try:
-        if 'csv' in filename:
-            # Assume that the user uploaded a CSV file
-            new_df = pd.read_csv(
-            io.StringIO(decoded.decode('utf-8')))
-            return parse_new_database(new_dbinfo, new_df)
-        elif 'xls' in filename:
-            # Assume that the user uploaded an excel file
-            new_df = pd.read_excel(io.BytesIO(decoded))
-            return parse_new_database(new_dbinfo, new_df)
+    def get_path(self, db_id):
+        return os.path.join(self.data_dir, db_id + '.parquet')
+
+    def get_parts_dir(self, db_id):
+        return os.path.join(self.data_dir, db_id + '.parts')
+
+    def get_paths(self, db_id):
+        """
+            Data files of a database: the file of its upload, then the part files of the appended rows
+            in order (their names start with the time they were created)
+        """
+        parts = sorted(glob.glob(os.path.join(glob.escape(self.get_parts_dir(db_id)), '*.parquet')))
+        return [self.get_path(db_id)] + parts
+
+    def get_version(self, db_id):
+        """
+            Latest modification time of the data files of a database, which changes whenever its rows change
+        """
+        return max(os.path.getmtime(path) for path in self.get_paths(db_id))
+
+    def exists(self, db_id):
+        return os.path.exists(self.get_path(db_id))
+
+    def lock(self, db_id):
+        """
+            Lock held while the data files of a database are replaced, see DatabaseLock
+        """
+        return DatabaseLock(os.path.join(self.data_dir, db_id + '.lock'))
+
+    def write(self, db_id, df):
+        """
+            Save the dataframe of a database, replacing any previous version
+        """
+        table = pa.Table.from_pandas(to_storage_types(df), preserve_index=False)
+        pq.write_table(table, self.get_path(db_id), compression=self.compression)
+        self.remove_parts(db_id)
+
+    def read(self, db_id, columns=None):
+        """
+            Load a database, reading only the requested columns from disk.
+            Requested columns that the database does not have are skipped.
+        """
+        return to_dataframe(self.read_table(db_id, columns))
+
+    def read_table(self, db_id, columns=None):
+        """
+            Load a database as an Arrow table, reading only the requested columns from disk
+        """
+        tables = [self.read_file(path, columns) for path in self.get_paths(db_id)]
+        return tables[0] if len(tables) == 1 else combine_tables(tables)
+
+    def read_file(self, path, columns=None, filters=None):
+        """
+            Rows of one data file that match the filters, with only the requested columns it has.
+            A file without one of the filtered columns has no matching rows.
+        """
+        if columns is not None or filters:
+            stored_columns = pq.read_schema(path).names
+            if columns is not None:
+                columns = [col for col in columns if col in stored_columns]
+            if filters and any(col not in stored_columns for col, op, value in filters):
+                empty_table = pq.read_schema(path).empty_table()
+                return empty_table if columns is None else empty_table.select(columns)
+        return pq.read_table(path, columns=columns, filters=filters or None)
+
+    def read_many(self, db_ids, columns=None):
+        """
+            Load several databases in parallel and combine them into a single dataframe.
+            The databases are aligned on a common schema first, so the combined dataframe
+            is built with one allocation instead of growing it database by database.
+        """
+        if len(db_ids) == 0:
+            return pd.DataFrame()
+        with ThreadPoolExecutor(max_workers=LOADER_THREADS) as pool:
+            tables = list(pool.map(lambda db_id: self.read_table(db_id, columns), db_ids))
+        return to_dataframe(combine_tables(tables))
+
+    def query_table(self, db_id, columns, filters=None):
+        """
+            Rows of a database that match the filters, with only the given columns. filters is a list of
+            (column, operator, value) conditions that must all hold, as in pyarrow.parquet.read_table;
+            they are pushed down to the file reader, which skips the row groups that cannot match.
+            A database without one of the filtered columns has no matching rows.
+        """
+        tables = [self.read_file(path, columns, filters) for path in self.get_paths(db_id)]
+        return tables[0] if len(tables) == 1 else combine_tables(tables)
+
+    def query_many(self, db_ids, columns, filters=None):
+        """
+            Rows of several databases that match the filters, queried in parallel and combined
+            into a single dataframe like in read_many
+        """
+        if len(db_ids) == 0:
+            return pd.DataFrame(columns=columns)
+        with ThreadPoolExecutor(max_workers=LOADER_THREADS) as pool:
+            tables = list(pool.map(lambda db_id: self.query_table(db_id, columns, filters), db_ids))
+        return to_dataframe(combine_tables(tables))
+
+    def query_batches(self, db_ids, filters=None, batch_rows=DOWNLOAD_CHUNK_ROWS):
+        """
+            Rows of several databases that match the filters, as Arrow tables of at most batch_rows rows
+            with the columns of all the databases (aligned as in combine_tables). The files are scanned
+            one batch at a time with the filters pushed down, so the rows are never loaded all at once.
+            A selection without matching rows gives a single empty table.
+        """
+        paths = [path for db_id in db_ids for path in self.get_paths(db_id)]
+        schema = combine_schemas([pq.read_schema(path) for path in paths])
+        expression = pq.filters_to_expression(filters) if filters else None
+        empty = True
+        for path in paths:
+            stored_columns = pq.read_schema(path).names
+            if filters and any(col not in stored_columns for col, op, value in filters):
+                continue
+            scanner = ds.dataset(path, format='parquet').scanner(filter=expression, batch_size=batch_rows)
+            for batch in scanner.to_batches():
+                if batch.num_rows > 0:
+                    empty = False
+                    yield align_table(pa.Table.from_batches([batch]), schema)
+        if empty:
+            yield schema.empty_table()
+
+    def get_column_stats(self, db_ids, col, filters=None):
+        """
+            Count, mean, standard deviation, minimum and maximum of a numeric column over the rows
+            of several databases that match the filters. The column is scanned batch by batch,
+            so it is never loaded whole.
+        """
+        paths = [path for db_id in db_ids for path in self.get_paths(db_id)]
+        with ThreadPoolExecutor(max_workers=LOADER_THREADS) as pool:
+            partial_stats = list(pool.map(lambda path: self._get_file_stats(path, col, filters), paths))
+        stats = ColumnStats()
+        for file_stats in partial_stats:
+            stats.merge(file_stats)
+        return stats
+
+    def _get_file_stats(self, path, col, filters):
+        stats = ColumnStats()
+        stored_columns = pq.read_schema(path).names
+        if col not in stored_columns or (filters and any(name not in stored_columns for name, op, value in filters)):
+            return stats
+        expression = pq.filters_to_expression(filters) if filters else None
+        scanner = ds.dataset(path, format='parquet').scanner(columns=[col], filter=expression)
+        for batch in scanner.to_batches():
+            stats.merge(ColumnStats.from_array(batch.column(0).cast(pa.float64())))
+        return stats
+
+    def get_content_hash(self, db_id):
+        """
+            Content hash of the rows of a database, added up from the saved hashes of its files,
+            so only the files changed since they were last hashed are read (see content_hash.py).
+            It does not depend on how the rows are split between the files.
+        """
+        return content_hash.combine_hashes([content_hash.get_file_hash(path) for path in self.get_paths(db_id)]).hexdigest()
+
+    def get_columns(self, db_id):
+        """
+            Column names of a database, read from the file footers without loading any data
+        """
+        columns = {}
+        for path in self.get_paths(db_id):
+            columns.update(dict.fromkeys(pq.read_schema(path).names))
+        return list(columns)
+
+    def open_appender(self, db_id):
+        return ParquetAppender(self.get_path(db_id), self.compression)
+
+    def open_part_appender(self, db_id):
+        """
+            Appender of a new part file of a database, for rows added after its upload. The name of
+            the file is unique, so appends to the same database can write their part files at the same time.
+        """
+        parts_dir = self.get_parts_dir(db_id)
+        os.makedirs(parts_dir, exist_ok=True)
+        part_name = '%020d-%s.parquet' % (time.time_ns(), uuid.uuid4().hex)
+        return ParquetAppender(os.path.join(parts_dir, part_name), self.compression)
+
+    def remove_parts(self, db_id):
+        shutil.rmtree(self.get_parts_dir(db_id), ignore_errors=True)
+
+    def remove_file(self, path):
+        """
+            Remove a part file of a database and its saved content hash
+        """
+        os.remove(path)
+        if os.path.exists(path + content_hash.HASH_SUFFIX):
+            os.remove(path + content_hash.HASH_SUFFIX)
+
+    def rewrite_file(self, path, keep):
+        """
+            Rewrite a data file with only the rows where keep is True, one row group at a time.
+            The content hash of the removed rows is subtracted from the saved hash of the file,
+            so the kept rows are not hashed again.
+        """
+        file_hash = content_hash.get_file_hash(path)
+        source = pq.ParquetFile(path)
+        tmp_path = path + '.tmp'
+        start = 0
+        with pq.ParquetWriter(tmp_path, source.schema_arrow, compression=self.compression) as writer:
+            for i in range(source.num_row_groups):
+                row_group = source.read_row_group(i)
+                row_group_keep = pa.array(keep[start:start + row_group.num_rows])
+                writer.write_table(row_group.filter(row_group_keep))
+                file_hash.remove(content_hash.hash_batches(row_group.filter(pc.invert(row_group_keep)).to_batches()))
+                start += row_group.num_rows
+        os.replace(tmp_path, path)
+        content_hash.save_file_hash(path, file_hash)
+
+    def compact_file(self, path):
+        """
+            Give the columns of a data file written before the compact types their compact types
+            (see dtype_optimizer.py), reading it one row group at a time. Returns whether the file was rewritten.
+        """
+        source = pq.ParquetFile(path)
+        profile = DtypeProfile()
+        for i in range(source.num_row_groups):
+            profile.update(source.read_row_group(i).to_pandas())
+        schema = profile.get_schema(source.schema_arrow, source.schema_arrow.names)
+        if schema.equals(source.schema_arrow):
+            return False
+        tmp_path = path + '.tmp'
+        with pq.ParquetWriter(tmp_path, schema, compression=self.compression) as writer:
+            for i in range(source.num_row_groups):
+                writer.write_table(source.read_row_group(i).cast(schema))
+        os.replace(tmp_path, path)
+        return True
+
+class ParquetAppender:
+    """
+        Writes a data file of the storage one chunk at a time. The file only replaces the
+        stored file when the appender is closed. At that point columns that stayed empty in every
+        chunk are dropped, and the other columns are given their compact types (see dtype_optimizer.py).
+    """
+    def __init__(self, path, compression):
+        self.path = path
+        self.compression = compression
+        # unique, so uploads of the same database can be written at the same time
+        self._tmp_path = '%s.%s.tmp' % (self.path, uuid.uuid4().hex)
+        self._writer = None
+        self._non_null_counts = None
+        self._profile = DtypeProfile()
+        self.num_rows = 0
+        # estimated memory in bytes of the loaded data with the default and the compact types,
+        # and the content hash of the rows of the file (see content_hash.py), set by finish
+        self.memory_usage = None
+        self.content_hash = None
+
+    def append(self, df):
+        df = to_storage_types(df)
+        self._profile.update(df)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            # text columns that are empty in the first chunk have no type yet
+            schema = pa.schema([pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                                for field in table.schema], metadata=table.schema.metadata)
+            table = table.cast(schema)
+            self._writer = pq.ParquetWriter(self._tmp_path, schema, compression=self.compression)
+            self._non_null_counts = dict.fromkeys(table.column_names, 0)
         else:
-            return 'Invalid file type.'
-    except Exception as e:
-        print(e)
-        return 'There was an error processing this file.'
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+        for col in table.column_names:
+            self._non_null_counts[col] += len(table) - table.column(col).null_count
+        self.num_rows += len(table)
+
+    def close(self):
+        self.finish()
+        self.commit()
+
+    def finish(self):
+        """
+            Complete the temporary file and compute the content hash of its rows, without replacing
+            the stored file yet, so the caller can still commit or abort the new file
+        """
+        if self._writer is None:
+            raise ValueError('No data was written')
+        self._writer.close()
+        keep = [col for col, count in self._non_null_counts.items() if count > 0]
+        schema = self._profile.get_schema(self._writer.schema, keep)
+        if not schema.equals(self._writer.schema):
+            self._rewrite(schema)
+        self.memory_usage = self._profile.get_memory_usage(schema)
+        # hashed one batch at a time, so the file is never loaded whole
+        self.content_hash = content_hash.hash_file(self._tmp_path)
+
+    def commit(self):
+        os.replace(self._tmp_path, self.path)
+        content_hash.save_file_hash(self.path, self.content_hash)
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+    def _rewrite(self, schema):
+        """
+            Rewrite the temporary file with the columns and types of schema, one row group at a time
+        """
+        source = pq.ParquetFile(self._tmp_path)
+        rewritten_path = self._tmp_path + '.rewritten'
+        with pq.ParquetWriter(rewritten_path, schema, compression=self.compression) as writer:
+            for i in range(source.num_row_groups):
+                writer.write_table(source.read_row_group(i, columns=schema.names).cast(schema))
+        os.replace(rewritten_path, self._tmp_path)
+
+class DatabaseLock:
+    """
+        Exclusive lock of a database, held while its data files and metadata are changed, so uploads
+        and appends to the same database replace its files one after the other. It locks a file
+        next to the data files, so it holds across the worker processes, except where file locks are
+        not available (Windows), where it only holds within the process.
+    """
+    _process_locks = {}
+    _process_locks_guard = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._process_lock = None
+
+    def __enter__(self):
+        if fcntl is None:
+            with DatabaseLock._process_locks_guard:
+                self._process_lock = DatabaseLock._process_locks.setdefault(self.path, threading.Lock())
+            self._process_lock.acquire()
+        else:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+        else:
+            self._process_lock.release()
+        return False
+
+class ColumnStats:
+    """
+        Running count, mean, standard deviation (with one degree of freedom, like pandas),
+        minimum and maximum of the values of a column. Stats of separate parts of a column are
+        merged with the parallel variance formula, so they are computed in one pass.
+    """
+    def __init__(self, count=0, mean=np.nan, sum_squares=0.0, min_value=np.nan, max_value=np.nan):
+        self.count = count
+        self.mean = mean
+        # sum of the squared differences from the mean
+        self.sum_squares = sum_squares
+        self.min = min_value
+        self.max = max_value
 
-def parse_new_database(new_dbinfo, new_df):
+    @classmethod
+    def from_array(cls, values):
+        count = len(values) - values.null_count
+        if count == 0:
+            return cls()
+        mean = pc.mean(values).as_py()
+        min_max = pc.min_max(values)
+        return cls(count, mean, pc.variance(values, ddof=0).as_py() * count,
+                   min_max['min'].as_py(), min_max['max'].as_py())
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return np.nan
+        return np.sqrt(self.sum_squares / (self.count - 1))
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.sum_squares = other.count, other.mean, other.sum_squares
+            self.min, self.max = other.min, other.max
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.sum_squares += other.sum_squares + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+storage = ParquetStorage(DATA_DIR, STORAGE_COMPRESSION)
+# database info of the uploaded databases, created from MetadataDB.csv on first use
+metadata_registry = MetadataRegistry(METADATA_DB_PATH, METADATA_PATH)
+
+# merged datasets of previous selections, shared by every callback that asks for the same selection
+materialized_cache = DataFrameCache(CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+_materialize_locks = {}
+_materialize_locks_guard = threading.Lock()
+# merged dataframes of previous selections, shared by the worker processes of the production server
+shared_store = SharedFrameStore(SHARED_CACHE_DIR, SHARED_CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+
+def combine_tables(tables):
+    """
+        Concatenate Arrow tables whose columns may differ between databases.
+        Columns missing from a table are filled with nulls, and a column stored with different
+        types is widened to float64 when all its types are numeric, or to strings otherwise.
+    """
+    schema = combine_schemas([table.schema for table in tables])
+    return pa.concat_tables([align_table(table, schema) for table in tables])
+
+def combine_schemas(schemas):
+    """
+        Schema holding the columns of all the schemas, with the types of combine_tables
+    """
+    fields = {}
+    for schema in schemas:
+        for field in schema:
+            current = fields.get(field.name)
+            if current is None or pa.types.is_null(current):
+                fields[field.name] = field.type
+            elif not (current == field.type or pa.types.is_null(field.type)):
+                numeric = all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in (current, field.type))
+                fields[field.name] = pa.float64() if numeric else pa.string()
+    return pa.schema(list(fields.items()))
+
+def align_table(table, schema):
+    """
+        Table with the columns and types of schema, filling the columns it does not have with nulls
+    """
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def to_storage_types(df):
+    """
+        Convert object columns holding mixed values (ex. numbers and text) into strings,
+        so that every stored column has a single type
+    """
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty'):
+            df[col] = df[col].where(df[col].isnull(), df[col].astype(str))
+    return df
+
+def to_dataframe(table):
+    """
+        Dataframe of an Arrow table read from the storage, with the integer counts as nullable
+        integers and the date parts as categories
+    """
+    return set_date_categories(table.to_pandas(types_mapper=NULLABLE_TYPES.get))
+
+def add_date_fields(df):
+    """
+        Store DATETIME as datetime64 and add the Year, Month and YearMonth (first day of the month) columns,
+        so the analyses never have to parse dates. They are made categorical when loaded.
+    """
+    df['DATETIME'] = pd.to_datetime(df['DATETIME'])
+    df['Year'] = df['DATETIME'].dt.year.astype('Int16')
+    df['Month'] = df['DATETIME'].dt.month.astype('Int8')
+    df['YearMonth'] = df['DATETIME'].dt.to_period('M').dt.to_timestamp()
+    return df
+
+def set_date_categories(df):
     """
-        Convert CSV or Excel file data into Pickle file and store in the data directory
+        Make the Year, Month and YearMonth columns categorical. Parquet keeps them as plain
+        integers and timestamps, so this is applied again after loading.
+    """
+    if 'Year' in df.columns:
+        df['Year'] = df['Year'].astype('Int16').astype('category')
+    if 'Month' in df.columns:
+        df['Month'] = df['Month'].astype('Int8').astype('category')
+    if 'YearMonth' in df.columns:
+        df['YearMonth'] = df['YearMonth'].astype('category')
+    return df
+
+def migrate_date_fields():
+    """
+        One-shot conversion of the stored databases that still have DATETIME as text
+        into a datetime64 column with the Year, Month and YearMonth columns
+    """
+    migrated = []
+    for path in sorted(glob.glob(storage.get_path('*'))):
+        db_id = os.path.splitext(os.path.basename(path))[0]
+        db_data = storage.read(db_id)
+        if 'YearMonth' not in db_data.columns:
+            storage.write(db_id, add_date_fields(db_data))
+            migrated.append(db_id)
+    return migrated
+
+def migrate_column_types():
+    """
+        One-shot conversion of the data files of the stored databases written before the compact
+        column types into their compact types. The content hash of a rewritten database is updated.
+    """
+    migrated = []
+    for path in sorted(glob.glob(storage.get_path('*'))):
+        db_id = os.path.splitext(os.path.basename(path))[0]
+        rewritten = [storage.compact_file(file_path) for file_path in storage.get_paths(db_id)]
+        if any(rewritten):
+            invalidate_database(db_id)
+            if metadata_registry.get_values('Content_hash', [db_id]).get(db_id):
+                metadata_registry.update(db_id, {'Content_hash': storage.get_content_hash(db_id)})
+            migrated.append(db_id)
+    return migrated
+
+def migrate_content_hashes():
+    """
+        One-shot computation of the content hashes of the stored databases uploaded before the
+        hashes were recorded, or recorded in an earlier format. Returns the IDs of the databases
+        that were hashed, and the pairs of databases found to hold the same data, which are reported but kept.
+    """
+    migrated = []
+    duplicates = []
+    metadata = load_metadata()
+    for db_id, current_hash in zip(metadata['DB_ID'], metadata['Content_hash']):
+        if not storage.exists(db_id):
+            continue
+        new_hash = storage.get_content_hash(db_id)
+        if new_hash == current_hash:
+            continue
+        duplicate = find_duplicate('Content_hash', new_hash, db_id)
+        if duplicate is not None:
+            duplicates.append((db_id, duplicate['DB_ID']))
+        metadata_registry.update(db_id, {'Content_hash': new_hash})
+        migrated.append(db_id)
+    return migrated, duplicates
+
+def migrate_pickles(data_dir=DATA_DIR):
+    """
+        One-shot conversion of the databases saved as Pickle files into the columnar storage.
+        The Pickle files are removed once their Parquet copy has been written.
+    """
+    migrated = []
+    for pkl_path in sorted(glob.glob(os.path.join(data_dir, '*.pkl'))):
+        db_id = os.path.splitext(os.path.basename(pkl_path))[0]
+        # only the app's own trusted files are unpickled, and only during this migration
+        db_data = pd.read_pickle(pkl_path)
+        storage.write(db_id, db_data)
+        os.remove(pkl_path)
+        migrated.append(db_id)
+    return migrated
+
+def read_upload_chunks(stream, filename):
+    """
+        Chunks of rows of an uploaded file, or None if the file type is not supported
+    """
+    if 'csv' in filename:
+        # Assume that the user uploaded a CSV file
+        return ingest.read_csv_chunks(stream)
+    elif 'xls' in filename:
+        # Assume that the user uploaded an excel file
+        return ingest.read_excel_chunks(stream, filename)
+    return None
+
+def parse_new_database(new_dbinfo, new_df, on_chunk=None, on_failed_rows=None, on_violations=None):
+    """
+        Convert CSV or Excel file data into a Parquet file and store in the data directory.
+        new_df is either a dataframe or an iterable of dataframe chunks, which are
+        formatted, validated and appended to the storage one at a time.
+        on_chunk is called with the number of rows stored after each chunk, on_failed_rows
+        with the rows of a chunk that could not be stored, with their row number and reason,
+        and on_violations with the report of the values of a chunk that did not pass the data checks.
     """    
+    if isinstance(new_df, pd.DataFrame):
+        new_df = ingest.split_dataframe(new_df)
+
+    appender = storage.open_appender(new_dbinfo.db_id)
     try:
+        unique_lakes = set()
+        coercion_errors = collections.Counter()
+        validator = Validator(on_violations)
+        for chunk in new_df:
+            chunk = format_chunk(drop_failed_rows(chunk, on_failed_rows), coercion_errors, validator)
+            unique_lakes.update(chunk["Body of Water Name"].dropna().unique())
+            appender.append(chunk)
+            if on_chunk is not None:
+                on_chunk(appender.num_rows)
+        appender.finish()
+
+        # the same data uploaded again, even from another file, is only stored once
+        db_content_hash = appender.content_hash.hexdigest()
+        duplicate = find_duplicate('Content_hash', db_content_hash, new_dbinfo.db_id)
+        if duplicate is not None:
+            appender.abort()
+            return duplicate_message(duplicate)
+        with storage.lock(new_dbinfo.db_id):
+            appender.commit()
+            # a new upload replaces the rows appended to an earlier upload of the same database
+            storage.remove_parts(new_dbinfo.db_id)
+            invalidate_database(new_dbinfo.db_id)
+
+            # update the number of lakes and samples and the content hash in db_info
+            new_dbinfo.db_num_lakes = len(unique_lakes)
+            new_dbinfo.db_num_samples = appender.num_rows
+            new_dbinfo.content_hash = db_content_hash
 
-        # delete the extra composite section of the lake names - if they have any
-        new_df['LakeName'] = new_df['LakeName'].\
-            str.replace(r"[-]?.COMPOSITE(.*)", "", regex=True).\
-            str.strip()
-        
-        new_df['Date'] = pd.to_datetime(new_df['Date']).dt.strftime('%Y-%m-%d %H:%M:%S')
-        print(new_df['LakeName'])
-        # convert mg to ug
-        new_df['TP_mgL'] *= 1000
-        new_df['TN_mgL'] *= 1000
-
-        # format all column names
-        new_df.rename(columns={'Date': 'DATETIME',
-                        'LakeName': 'Body of Water Name',
-                        'Lat': 'LAT',
-                        'Long': 'LONG',
-                        'Altitude_m': 'Altitude (m)',
-                        'MaximumDepth_m': 'Maximum Depth (m)',
-                        'MeanDepth_m': 'Mean Depth (m)',
-                        'SecchiDepth_m': 'Secchi Depth (m)',
-                        'SamplingDepth_m': 'Sampling Depth (m)',
-                        'ThermoclineDepth_m': 'Thermocline Depth (m)',
-                        'SurfaceTemperature_C': 'Surface Temperature (degrees celsius)',
-                        'EpilimneticTemperature_C': 'Epilimnetic Temperature (degrees celsius)',
-                        'TP_mgL': 'Total Phosphorus (ug/L)',
-                        'TN_mgL': 'Total Nitrogen (ug/L)',
-                        'NO3NO2_mgL': 'NO3 NO2 (mg/L)',
-                        'NH4_mgL': 'NH4 (mg/L)',
-                        'PO4_ugL': 'PO4 (ug/L)',
-                        'Chlorophylla_ugL': 'Total Chlorophyll a (ug/L)',
-                        'Chlorophyllb_ugL': 'Total Chlorophyll b (ug/L)',
-                        'Zeaxanthin_ugL': 'Zeaxanthin (ug/L)',
-                        'Diadinoxanthin_ugL': 'Diadinoxanthin (ug/L)',
-                        'Fucoxanthin_ugL': 'Fucoxanthin (ug/L)',
-                        'Diatoxanthin_ugL': 'Diatoxanthin (ug/L)',
-                        'Alloxanthin_ugL': 'Alloxanthin (ug/L)',
-                        'Peridinin_ugL': 'Peridinin (ug/L)',
-                        'Chlorophyllc2_ugL': 'Total Chlorophyll c2 (ug/L)',
-                        'Echinenone_ugL': 'Echinenone (ug/L)',
-                        'Lutein_ugL': 'Lutein (ug/L)',
-                        'Violaxanthin_ugL': 'Violaxanthin (ug/L)',
-                        'TotalMC_ug/L': 'Microcystin (ug/L)',
-                        'DissolvedMC_ugL': 'DissolvedMC (ug/L)',
-                        'MC_YR_ugL': 'Microcystin YR (ug/L)',
-                        'MC_dmRR_ugL': 'Microcystin dmRR (ug/L)',
-                        'MC_RR_ugL': 'Microcystin RR (ug/L)',
-                        'MC_dmLR_ugL': 'Microcystin dmLR (ug/L)',
-                        'MC_LR_ugL': 'Microcystin LR (ug/L)',
-                        'MC_LY_ugL': 'Microcystin LY (ug/L)',
-                        'MC_LW_ugL': 'Microcystin LW (ug/L)',
-                        'MC_LF_ugL': 'Microcystin LF (ug/L)',
-                        'NOD_ugL': 'Nodularin (ug/L)',
-                        'CYN_ugL': 'Cytotoxin Cylindrospermopsin (ug/L)',
-                        'ATX_ugL': 'Neurotoxin Anatoxin-a (ug/L)',
-                        'GEO_ugL': 'Geosmin (ug/L)',
-                        '2MIB_ngL': '2-MIB (ng/L)',
-                        'TotalPhyto_CellsmL': 'Phytoplankton (Cells/mL)',
-                        'Cyano_CellsmL': 'Cyanobacteria (Cells/mL)',
-                        'PercentCyano': 'Relative Cyanobacterial Abundance (percent)',
-                        'DominantBloomGenera': 'Dominant Bloom',
-                        'mcyD_genemL': 'mcyD gene (gene/mL)',
-                        'mcyE_genemL': 'mcyE gene (gene/mL)',},
-                inplace=True)
-
-        # remove NaN columns       
-        new_df = new_df.dropna(axis=1, how='all')
-
-        #save the pickle and csv file in the data directory
-        pkldir = get_pkl_path(new_dbinfo.db_id)
-        new_df.to_pickle(pkldir)
-
-        csvdir = get_csv_path(new_dbinfo.db_id)
-        new_df.to_csv(csvdir)
-
-        # update the number of lakes and samples in db_info
-        unique_lakes_list = list(new_df["Body of Water Name"].unique())
-        new_dbinfo.db_num_lakes = len(unique_lakes_list)
-        new_dbinfo.db_num_samples = new_df.shape[0]
-
-        current_metadata = metadataDB
-        update_metadata(new_dbinfo, current_metadata)
-        return u'''Database "{}" has been successfully uploaded.'''.format(new_dbinfo.db_name)
+            update_metadata(new_dbinfo)
+        default_bytes, compact_bytes = appender.memory_usage
+        return u'''Database "{}" has been successfully uploaded. Its data takes {} in memory instead of {} ({:.0%} less).'''.format(
+            new_dbinfo.db_name, format_bytes(compact_bytes), format_bytes(default_bytes), 1 - compact_bytes / max(default_bytes, 1)) + \
+            format_coercion_errors(coercion_errors) + validator.format_counts()
     
     except Exception as e:
+        appender.abort()
+        print(e)
+        return 'Error uploading database'
+
+def upsert_database(db_id, new_df, on_chunk=None, on_failed_rows=None, on_violations=None):
+    """
+        Add rows to an existing database. A row with the same lake, date and sampling depth
+        (ROW_KEY_COLUMNS) as a stored row replaces it, and the other rows are appended.
+        The rows are written to a new part file of the database, and only the stored files
+        that hold replaced rows are rewritten (part files left without rows are removed).
+        The number of lakes and samples in the metadata is updated from the added and replaced rows,
+        without reading the stored measurements. The files and the metadata are changed while
+        holding the lock of the database, so appends to the same database running at the same
+        time replace each other's rows in turn and both add their counts.
+        new_df, on_chunk, on_failed_rows and on_violations are as in parse_new_database.
+    """
+    if len(metadata_registry.find('DB_ID', db_id)) == 0 or not storage.exists(db_id):
+        return 'There is no database "{}".'.format(db_id)
+    if isinstance(new_df, pd.DataFrame):
+        new_df = ingest.split_dataframe(new_df)
+
+    appender = storage.open_part_appender(db_id)
+    try:
+        new_keys = []
+        new_lakes = set()
+        coercion_errors = collections.Counter()
+        validator = Validator(on_violations)
+        for chunk in new_df:
+            chunk = format_chunk(drop_failed_rows(chunk, on_failed_rows), coercion_errors, validator)
+            new_keys.append(get_row_keys(chunk))
+            new_lakes.update(chunk["Body of Water Name"].dropna().unique())
+            appender.append(chunk)
+            if on_chunk is not None:
+                on_chunk(appender.num_rows)
+        appender.finish()
+    except Exception as e:
+        appender.abort()
         print(e)
         return 'Error uploading database'
 
-def update_metadata(new_dbinfo, current_metadata):
+    new_keys = new_keys[0].append(new_keys[1:]) if new_keys else pd.MultiIndex.from_arrays([[], [], []])
+    with storage.lock(db_id):
+        stored_paths = storage.get_paths(db_id)
+        appender.commit()
+
+        # remove the stored rows replaced by the new rows, only reading the key columns of each file
+        stored_lakes = set()
+        num_replaced = 0
+        for path in stored_paths:
+            stored_keys = get_row_keys(storage.read_file(path, ROW_KEY_COLUMNS).to_pandas())
+            stored_lakes.update(stored_keys.get_level_values(0).unique())
+            replaced = stored_keys.isin(new_keys)
+            if replaced.all() and path != storage.get_path(db_id):
+                storage.remove_file(path)
+            elif replaced.any():
+                storage.rewrite_file(path, ~replaced)
+            num_replaced += int(replaced.sum())
+        invalidate_database(db_id)
+
+        # a replaced row has the same lake as the row replacing it, so no lake is ever removed
+        stored_lakes.discard('')
+        metadata_registry.increment(db_id, {'N_lakes': len(new_lakes - stored_lakes),
+                                            'N_samples': appender.num_rows - num_replaced},
+                                    {'Content_hash': storage.get_content_hash(db_id)})
+    return u'''Database "{}" has been successfully updated: {} rows added, {} of them replacing stored rows.'''.format(
+        db_id, appender.num_rows, num_replaced) + format_coercion_errors(coercion_errors) + validator.format_counts()
+
+def get_row_keys(df):
+    """
+        Key of each row of a dataframe: its lake, date and sampling depth, with missing values
+        replaced so they compare equal
+    """
+    columns = df.reindex(columns=ROW_KEY_COLUMNS)
+    lakes = columns['Body of Water Name'].astype(object).where(columns['Body of Water Name'].notnull(), '').astype(str)
+    dates = pd.to_datetime(columns['DATETIME']).astype('datetime64[ns]').fillna(pd.Timestamp.min)
+    depths = pd.to_numeric(columns['Sampling Depth (m)'], errors='coerce').fillna(-np.inf)
+    return pd.MultiIndex.from_arrays([lakes.to_numpy(), dates.to_numpy(), depths.to_numpy()])
+
+def drop_failed_rows(chunk, on_failed_rows=None):
+    """
+        Rows of a chunk of uploaded rows that can be stored. The others are passed to on_failed_rows
+        with their row number in the file and the reason they failed.
+    """
+    reasons = find_failed_rows(chunk)
+    failed = reasons.notnull()
+    if failed.any():
+        if on_failed_rows is not None:
+            on_failed_rows(chunk[failed].assign(Row=chunk.index[failed] + 2, Reason=reasons[failed]))
+        chunk = chunk[~failed]
+    return chunk
+
+def find_failed_rows(chunk):
+    """
+        Reason why each row of a chunk of uploaded rows cannot be stored, or None for valid rows
+    """
+    reasons = pd.Series(None, index=chunk.index, dtype=object)
+    dates = pd.to_datetime(chunk['Date'], errors='coerce')
+    reasons[dates.isnull() & chunk['Date'].notnull()] = 'Date could not be read'
+    return reasons
+
+def format_chunk(chunk, coercion_errors=None, validator=None):
+    """
+        Clean up, rename, type and convert the units of the columns of a chunk of uploaded rows,
+        as defined in the column registry (schema.py). The number of values of each numeric column
+        that are not numbers is added to the coercion_errors Counter. When a validator is given, the
+        values reported against a detection limit are parsed, the values that are not numbers are
+        reported, and the data checks are run on the chunk.
+    """
+    chunk = chunk.copy()
+    # delete the extra composite section of the lake names - if they have any
+    chunk['LakeName'] = chunk['LakeName'].astype(str).where(chunk['LakeName'].notnull()).\
+        str.replace(r"[-]?.COMPOSITE(.*)", "", regex=True).\
+        str.strip()
+
+    # format all column names
+    chunk = chunk.rename(columns=SOURCE_NAMES)
+    if validator is not None:
+        chunk = validator.parse_detection_limits(chunk)
+
+    # every chunk gets the same column types, text for names and comments and numbers for measurements
+    uploaded = chunk
+    chunk, errors = coerce_columns(chunk)
+    if coercion_errors is not None:
+        coercion_errors.update(errors)
+    if validator is not None:
+        validator.check_parsed(uploaded, chunk)
+
+    # parse the dates once, here, and precompute the date parts used by the analyses
+    chunk = add_date_fields(chunk)
+    if validator is not None:
+        chunk = validator.check(chunk)
+    return chunk
+
+def format_coercion_errors(coercion_errors):
     """
-        Add new database info to MetadataDB.csv
+        Sentence reporting the values that were not numbers, or an empty string if there were none
+    """
+    if not coercion_errors:
+        return ''
+    return ' {} values that are not numbers were left empty ({}).'.format(
+        sum(coercion_errors.values()), ', '.join('{}: {}'.format(col, count) for col, count in coercion_errors.most_common()))
+
+def load_metadata():
+    """
+        Database info of the uploaded databases, from the metadata registry
+    """
+    return metadata_registry.get_all()
+
+def update_metadata(new_dbinfo):
+    """
+        Add new database info to the metadata registry
     """ 
     try:
-        current_metadata = pd.read_csv("data/MetadataDB.csv")
-        
-        new_dbdf = pd.DataFrame({'DB_ID': [new_dbinfo.db_id],
-                                'DB_name': [new_dbinfo.db_name],
-                                'Uploaded_by': [new_dbinfo.uploaded_by],
-                                'Upload_date': [new_dbinfo.upload_date],
-                                'Published_url': [new_dbinfo.db_publication_url], #url
-                                'Field_method_url': [new_dbinfo.db_field_method_url], #url
-                                'Lab_method_url': [new_dbinfo.db_lab_method_url], #url
-                                'QA_QC_url': [new_dbinfo.db_QAQC_url], #url
-                                'Full_QA_QC_url': [new_dbinfo.db_full_QCQC_url], #url
-                                'Substrate': [new_dbinfo.db_substrate],
-                                'Sample_type': [new_dbinfo.db_sample_type],
-                                'Field-method': [new_dbinfo.db_field_method],
-                                'Microcystin_method': [new_dbinfo.db_microcystin_method],
-                                'Filter_size': [new_dbinfo.db_filter_size],
-                                'Cell_count_method': [new_dbinfo.db_cell_count_method],
-                                'Ancillary_data': [new_dbinfo.db_ancillary_url],
-                                'N_lakes': [new_dbinfo.db_num_lakes],
-                                'N_samples': [new_dbinfo.db_num_samples]})
-
-        metadataDB = pd.concat([current_metadata, new_dbdf], sort=False).reset_index(drop=True)
-        metadataDB.to_csv("data/MetadataDB.csv", encoding='utf-8', index=False)
+        metadata_registry.add({'DB_ID': new_dbinfo.db_id,
+                               'DB_name': new_dbinfo.db_name,
+                               'Uploaded_by': new_dbinfo.uploaded_by,
+                               'Upload_date': new_dbinfo.upload_date,
+                               'Published_url': new_dbinfo.db_publication_url, #url
+                               'Field_method_url': new_dbinfo.db_field_method_url, #url
+                               'Lab_method_url': new_dbinfo.db_lab_method_url, #url
+                               'QA_QC_url': new_dbinfo.db_QAQC_url, #url
+                               'Full_QA_QC_url': new_dbinfo.db_full_QCQC_url, #url
+                               'Substrate': new_dbinfo.db_substrate,
+                               'Sample_type': new_dbinfo.db_sample_type,
+                               'Field-method': new_dbinfo.db_field_method,
+                               'Microcystin_method': new_dbinfo.db_microcystin_method,
+                               'Filter_size': new_dbinfo.db_filter_size,
+                               'Cell_count_method': new_dbinfo.db_cell_count_method,
+                               'Ancillary_data': new_dbinfo.db_ancillary_url,
+                               'N_lakes': int(new_dbinfo.db_num_lakes),
+                               'N_samples': int(new_dbinfo.db_num_samples),
+                               'File_hash': new_dbinfo.file_hash,
+                               'Content_hash': new_dbinfo.content_hash})
     except Exception as e:
         print(e)
         return 'Error saving metadata'
 
+def find_duplicate(column, value, db_id):
+    """
+        Metadata (a row of the registry) of a database other than db_id whose File_hash or
+        Content_hash column equals value, or None if there is none
+    """
+    if value is None:
+        return None
+    duplicates = metadata_registry.find(column, value)
+    duplicates = duplicates[duplicates['DB_ID'] != db_id]
+    if len(duplicates) == 0:
+        return None
+    return duplicates.iloc[0]
+
+def duplicate_message(duplicate):
+    return u'''Database "{}" already holds the data of this file, so it was not stored again.'''.format(duplicate['DB_name'])
+
 def update_dataframe(selected_rows):    
     """
         update dataframe based on selected databases 
     """
+    dataset = materialize([row["DB_ID"] for row in selected_rows])
+    if dataset is not None:
+        return dataset.df
+
+def get_materialization_key(db_ids):
+    """
+        Key of a selection: the sorted content hashes of the selected databases, so selections holding
+        identical data share their dataframe and aggregates, and a database whose data changes never
+        matches a dataframe merged before the change. Databases stored without a content hash are
+        keyed by their ID and the latest modification time of their data files.
+    """
+    db_ids = sorted(set(db_ids))
+    content_hashes = metadata_registry.get_values('Content_hash', db_ids)
+    return tuple(sorted(('content', content_hashes[db_id]) if content_hashes.get(db_id) else
+                        ('file', db_id, storage.get_version(db_id)) for db_id in db_ids))
+
+def materialize(db_ids):
+    """
+        Return the Dataset of the selected databases, building its dataframe and indexes only once.
+        Concurrent requests for the same selection wait for the first one instead of loading it again.
+    """
+    try:
+        key = get_materialization_key(db_ids)
+    except Exception as e:
+        print("EXCEPTION: ", e)
+        return None
+
+    dataset = materialized_cache.get(key)
+    if dataset is not None:
+        return dataset
+
+    with _materialize_locks_guard:
+        key_lock = _materialize_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        dataset = materialized_cache.get(key)
+        if dataset is None:
+            new_dataframe = load_shared_dataframe(key, db_ids)
+            if new_dataframe is not None:
+                dataset = Dataset(new_dataframe)
+                materialized_cache.put(key, dataset, dataset.memory_usage())
+    with _materialize_locks_guard:
+        _materialize_locks.pop(key, None)
+    return dataset
+
+def load_shared_dataframe(key, db_ids):
+    """
+        Return the dataframe of a selection from the store shared by the worker processes,
+        building it and adding it to the store if no worker has built it yet
+    """
+    new_dataframe = shared_store.get(key)
+    if new_dataframe is not None:
+        # Arrow restores the categories of Year and Month as plain integers
+        return set_date_categories(new_dataframe)
+    new_dataframe = build_dataframe(db_ids)
+    if new_dataframe is not None:
+        try:
+            shared_store.put(key, new_dataframe)
+        except Exception as e:
+            # the selection can still be used by this worker
+            print("EXCEPTION: ", e)
+    return new_dataframe
+
+def invalidate_database(db_id):
+    """
+        Drop the cached selections that include a database whose data has changed.
+        Called before the new content hash of the database is saved in the registry.
+    """
+    content_hashes = metadata_registry.get_values('Content_hash', [db_id])
+    stale = {('content', content_hashes.get(db_id))}
+    for key in materialized_cache.keys():
+        if any(element in stale or element[1] == db_id for element in key):
+            materialized_cache.pop(key)
+
+def build_dataframe(db_ids, columns=None):
+    """
+        Load the selected databases, optionally only the given columns, and add the derived columns
+    """
+    try:
+        # Read in data from selected Parquet files in parallel, and concatenate the data once
+        new_dataframe = storage.read_many(sorted(set(db_ids)), columns)
+        return add_derived_metrics(new_dataframe)
+    except Exception as e:
+        print("EXCEPTION: ", e)
+
+def query(db_ids, columns, filters=None):
+    """
+        Rows of the selected databases that match the filters, with only the given columns.
+        The filters run on the stored files as they are read (see ParquetStorage.query_table),
+        so only the matching rows are loaded, however many databases are selected.
+        Only stored columns can be queried, not the derived columns.
+    """
+    try:
+        return storage.query_many(sorted(set(db_ids)), columns, filters)
+    except Exception as e:
+        print("EXCEPTION: ", e)
+        return pd.DataFrame(columns=columns)
+
+def query_batches(db_ids, filters=None):
+    """
+        Rows of the selected databases that match the filters, as a generator of Arrow tables of
+        DOWNLOAD_CHUNK_ROWS rows read one at a time from the stored files (see ParquetStorage.query_batches),
+        with the derived ratios. The percent change depends on the previous sample of each site,
+        so it is only in the materialized dataframe. Returns None if a database is not stored.
+    """
+    db_ids = sorted(set(db_ids))
+    if not all(storage.exists(db_id) for db_id in db_ids):
+        return None
+    return (add_derived_ratios(table) for table in storage.query_batches(db_ids, filters))
+
+def get_column_stats(db_ids, col, filters=None):
+    """
+        Count, mean, std, min and max of a stored numeric column over the rows of the selected
+        databases that match the filters, computed on the stored files
+    """
     try:
-        new_dataframe = pd.DataFrame()    
-        # Read in data from selected Pickle files into Pandas dataframes, and concatenate the data
-        for row in selected_rows:
-            rowid = row["DB_ID"]
-            filepath = get_pkl_path(rowid)
-            db_data = pd.read_pickle(filepath)
-            new_dataframe = pd.concat([new_dataframe, db_data], sort=False).reset_index(drop=True)
-
-        # Ratio of Total Nitrogen to Total Phosphorus
-        # This line causes a problem on certain datasets as the columns are strings instead of ints and will not divide, dataset dependent
-        print(new_dataframe["Total Nitrogen (ug/L)"])
-        print("Phosphorus: ", new_dataframe["Total Phosphorus (ug/L)"])
-        new_dataframe["TN:TP"] = new_dataframe["Total Nitrogen (ug/L)"]/new_dataframe["Total Phosphorus (ug/L)"]
-        # Ration of Microcystin to Total Chlorophyll
-        new_dataframe["Microcystin:Chlorophyll a"] = new_dataframe["Microcystin (ug/L)"]/new_dataframe["Total Chlorophyll a (ug/L)"]
-        # Percent change of microcystin
-        new_dataframe["MC Percent Change"] = new_dataframe.sort_values("DATETIME").\
-                                            groupby(['LONG','LAT'])["Microcystin (ug/L)"].\
-                                            apply(lambda x: x.pct_change()).fillna(0)
-        return new_dataframe
+        return storage.get_column_stats(sorted(set(db_ids)), col, filters)
     except Exception as e:
         print("EXCEPTION: ", e)
+        return ColumnStats()
+
+def get_columns(db_ids):
+    """
+        Names of the columns of the selected databases, including the derived columns,
+        read from the schemas of the stored files without loading any data
+    """
+    columns = {}
+    for db_id in sorted(set(db_ids)):
+        columns.update(dict.fromkeys(storage.get_columns(db_id)))
+    return list(columns) + DERIVED_COLUMNS
+
+def is_stored_column(col):
+    return col not in DERIVED_COLUMNS
+
+# derived ratio columns, with the columns they divide
+DERIVED_RATIOS = [
+    ("TN:TP", "Total Nitrogen (ug/L)", "Total Phosphorus (ug/L)"),
+    ("Microcystin:Chlorophyll a", "Microcystin (ug/L)", "Total Chlorophyll a (ug/L)"),
+]
+
+def add_derived_metrics(new_dataframe):
+    """
+        Add the ratio and percent change columns computed from the measured data
+    """
+    # Ratios of Total Nitrogen to Total Phosphorus and of Microcystin to Total Chlorophyll
+    for name, numerator, denominator in DERIVED_RATIOS:
+        new_dataframe[name] = safe_divide(get_numeric_column(new_dataframe, numerator),
+                                          get_numeric_column(new_dataframe, denominator))
+    # Percent change of microcystin between consecutive samples of each site
+    new_dataframe["MC Percent Change"] = site_percent_change(new_dataframe, "Microcystin (ug/L)")
+    return new_dataframe
+
+def get_numeric_column(df, col):
+    """
+        Column as floats, with text that is not a number as NaN, or all NaN if the column is missing
+    """
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+
+def add_derived_ratios(table):
+    """
+        Add the ratio columns of DERIVED_RATIOS to an Arrow table
+    """
+    for name, numerator, denominator in DERIVED_RATIOS:
+        table = table.append_column(name, pa.array(safe_divide(get_table_column(table, numerator),
+                                                               get_table_column(table, denominator))))
+    return table
+
+def get_table_column(table, col):
+    """
+        Column of an Arrow table as floats with nulls as NaN, or all NaN if the table does not have it
+    """
+    if col not in table.column_names:
+        return np.full(table.num_rows, np.nan)
+    return pd.to_numeric(table.column(col).to_pandas(), errors='coerce').to_numpy(dtype=float)
+
+def safe_divide(numerator, denominator):
+    """
+        Element-wise division that gives NaN instead of inf where the denominator is zero or missing
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = numerator / denominator
+    ratio[~np.isfinite(ratio)] = np.nan
+    return ratio
+
+def site_percent_change(df, col):
+    """
+        Percent change of a column from the previous sample at the same site (LONG, LAT) in date order,
+        computed with array shifts over the site-sorted data instead of a Python function per site.
+        Missing values are carried forward within a site, and the first sample of a site is 0.
+    """
+    values = get_numeric_column(df, col)
+    if len(df) == 0 or 'LONG' not in df.columns or 'LAT' not in df.columns:
+        return np.zeros(len(df))
+
+    # integer key of each site, -1 for samples without coordinates
+    site = df.groupby(['LONG', 'LAT'], sort=False).ngroup().to_numpy()
+    dates = pd.to_datetime(df['DATETIME']).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    order = np.lexsort((dates, site))
+
+    sorted_site = site[order]
+    sorted_values = pd.Series(values[order]).groupby(sorted_site).ffill().to_numpy()
+    previous = np.empty_like(sorted_values)
+    previous[0] = np.nan
+    previous[1:] = sorted_values[:-1]
+    previous[1:][sorted_site[1:] != sorted_site[:-1]] = np.nan
 
-def get_pkl_path(db_id):
-    return 'data/' + db_id + '.pkl'
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sorted_change = sorted_values / previous - 1
+    sorted_change[np.isnan(sorted_change) | (sorted_site < 0)] = 0
 
-def get_csv_path(db_id):
-    return 'data/' + db_id + '.csv'
-        
\ No newline at end of file
+    change = np.empty_like(sorted_change)
+    change[order] = sorted_change
+    return change
@@ -22,4 +22,7 @@ class db_info:
         self.db_cell_count_method = ''
         self.db_ancillary_url = ''
         self.db_num_lakes = 0
-        self.db_num_samples = 0
\ No newline at end of file
+        self.db_num_samples = 0
+        # content hashes of the uploaded file and of its stored rows
+        self.file_hash = None
+        self.content_hash = None
\ No newline at end of file
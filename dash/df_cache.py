@@ -0,0 +1,68 @@
+"""
+    Server-side store for the dataframes selected by the users of the app
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class DataFrameCache:
+    """
+        Thread-safe LRU store of dataframes, bounded by total memory and entry age.
+        Entries are evicted least-recently-used first once the memory budget is exceeded,
+        and are dropped on access once they are older than the time-to-live.
+    """
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+            return the dataframe stored under key, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, created = entry
+            if time.time() - created > self.ttl_seconds:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size=None):
+        """
+            store value under key and evict old entries until the cache fits its memory budget
+        """
+        if size is None:
+            size = int(value.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.time())
+            self._total_bytes += size
+            # always keep the newest entry, even if it alone is over the budget
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def _remove(self, key):
+        value, size, created = self._entries.pop(key)
+        self._total_bytes -= size
@@ -0,0 +1,76 @@
+"""
+    Downsampling of time series to a number of points that the browser can draw quickly,
+    keeping the visual shape of the series
+"""
+import numpy as np
+
+def downsample(x, y, max_points, method='lttb'):
+    """
+        Positions of the points to draw so that a series fits in max_points.
+        x must be sorted; points with a missing x or y are dropped.
+        method is 'lttb' (Largest-Triangle-Three-Buckets, for lines) or
+        'minmax' (lowest and highest point of each bucket, for scatter plots).
+    """
+    x = as_float(x)
+    y = np.asarray(y, dtype=float)
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(valid) <= max_points:
+        return valid
+    if method == 'minmax':
+        kept = minmax(y[valid], max_points)
+    else:
+        kept = lttb(x[valid], y[valid], max_points)
+    return valid[kept]
+
+def lttb(x, y, n_out):
+    """
+        Positions of the n_out points chosen by Largest-Triangle-Three-Buckets. The first and last
+        points are kept, and from each bucket in between the point forming the largest triangle
+        with the previously kept point and the average of the next bucket.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    kept = np.empty(n_out, dtype=int)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        xa, ya = x[previous], y[previous]
+        area = np.abs((xa - next_x) * (y[start:end] - ya) - (xa - x[start:end]) * (next_y - ya))
+        previous = start + int(np.argmax(area))
+        kept[i + 1] = previous
+    return kept
+
+def minmax(y, max_points):
+    """
+        Positions of the lowest and highest points of max_points / 2 buckets of consecutive points
+    """
+    n = len(y)
+    n_buckets = max(max_points // 2, 1)
+    bucket = np.arange(n) * n_buckets // n
+    order = np.lexsort((y, bucket))
+    sorted_bucket = bucket[order]
+    first = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.unique(np.r_[order[first], order[last]])
+
+def as_float(x):
+    """
+        Values as floats, with datetimes as nanoseconds and missing datetimes as NaN
+    """
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        missing = np.isnat(x)
+        x = x.astype('datetime64[ns]').astype(np.int64).astype(float)
+        x[missing] = np.nan
+        return x
+    return x.astype(float)
@@ -0,0 +1,119 @@
+"""
+    Compact column types for the uploaded databases, chosen when a database is stored:
+    categories for the names that repeat from row to row, float32 for measurements whose
+    values keep all their digits in single precision, and nullable integers for counts
+"""
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from schema import get_names
+
+# text columns with few distinct values, stored as categories (Arrow dictionaries)
+CATEGORY_COLUMNS = get_names('category')
+# counts of cells and genes, stored as integers when every value is a whole number
+COUNT_COLUMNS = get_names('count')
+# any decimal number of up to 6 significant digits is read back unchanged from a float32
+FLOAT32_DIGITS = 6
+# Arrow types of the stored columns that are loaded with a pandas type other than the default
+NULLABLE_TYPES = {pa.int64(): pd.Int64Dtype()}
+
+class DtypeProfile:
+    """
+        Follows the values of the chunks of a database as they are stored, to choose the compact
+        type of each column once every chunk has been seen. Also adds up the memory that the
+        loaded columns take with the default types, to report the memory saved by the compact types.
+    """
+    def __init__(self):
+        self.num_rows = 0
+        self.default_bytes = {}
+        self.categories = {}
+        self.fits_float32 = {}
+        self.is_whole = {}
+
+    def update(self, df):
+        self.num_rows += len(df)
+        for col, nbytes in df.memory_usage(deep=True, index=False).items():
+            self.default_bytes[col] = self.default_bytes.get(col, 0) + nbytes
+        for col in df.columns:
+            if col in CATEGORY_COLUMNS:
+                self.categories.setdefault(col, set()).update(df[col].dropna().unique())
+            elif pd.api.types.is_float_dtype(df[col]):
+                values = df[col].to_numpy(dtype=float)
+                self.fits_float32[col] = self.fits_float32.get(col, True) and fits_float32(values)
+                if col in COUNT_COLUMNS:
+                    self.is_whole[col] = self.is_whole.get(col, True) and is_whole(values)
+
+    def get_type(self, field):
+        """
+            Compact Arrow type of a stored column
+        """
+        if field.name in self.categories and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+            return pa.dictionary(pa.int32(), pa.string())
+        if pa.types.is_float64(field.type):
+            if self.is_whole.get(field.name):
+                return pa.int64()
+            if self.fits_float32.get(field.name):
+                return pa.float32()
+        return field.type
+
+    def get_schema(self, schema, columns):
+        """
+            Schema of the given columns of a stored file with their compact types
+        """
+        return pa.schema([pa.field(col, self.get_type(schema.field(col))) for col in columns], metadata=schema.metadata)
+
+    def get_memory_usage(self, schema):
+        """
+            Estimated memory in bytes of the loaded columns of schema, with the default types
+            and with the compact types of schema
+        """
+        default_bytes = sum(self.default_bytes.get(col, 0) for col in schema.names)
+        compact_bytes = 0
+        for field in schema:
+            if pa.types.is_dictionary(field.type):
+                compact_bytes += category_bytes(self.categories[field.name], self.num_rows)
+            elif pa.types.is_int64(field.type) and field.name in self.is_whole:
+                # values and mask of a nullable integer column
+                compact_bytes += 9 * self.num_rows
+            elif pa.types.is_float32(field.type):
+                compact_bytes += 4 * self.num_rows
+            else:
+                compact_bytes += self.default_bytes.get(field.name, 0)
+        return default_bytes, compact_bytes
+
+def fits_float32(values):
+    """
+        Whether every value has at most FLOAT32_DIGITS significant digits and is within the range
+        of float32, so that a float32 keeps the value as it was written in the uploaded file
+    """
+    values = values[np.isfinite(values) & (values != 0)]
+    if len(values) == 0:
+        return True
+    magnitude = np.abs(values)
+    if magnitude.max() > np.finfo(np.float32).max or magnitude.min() < np.finfo(np.float32).tiny:
+        return False
+    scale = 10.0 ** (FLOAT32_DIGITS - 1 - np.floor(np.log10(magnitude)))
+    return bool(np.allclose(np.round(values * scale) / scale, values, rtol=1e-12, atol=0))
+
+def is_whole(values):
+    """
+        Whether every value is a whole number that an int64 holds exactly
+    """
+    values = values[~np.isnan(values)]
+    return bool(np.all(np.isfinite(values) & (values == np.round(values)) & (np.abs(values) < 2 ** 53)))
+
+def category_bytes(categories, num_rows):
+    """
+        Memory in bytes of a categorical column: the codes of the rows and the distinct values
+    """
+    if len(categories) < 2 ** 7:
+        code_bytes = 1
+    elif len(categories) < 2 ** 15:
+        code_bytes = 2
+    else:
+        code_bytes = 4
+    return code_bytes * num_rows + sum(sys.getsizeof(value) + 8 for value in categories)
+
+def format_bytes(nbytes):
+    return '%.1f MB' % (nbytes / 1e6)
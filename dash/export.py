@@ -0,0 +1,60 @@
+"""
+    Writers that stream the rows of a selection to the download route of the app, from the Arrow
+    tables of a few thousand rows read from the storage (see db_engine.query_batches), so an export
+    never holds more than one table of rows in memory
+"""
+import tempfile
+import zlib
+import pyarrow.parquet as pq
+from dtype_optimizer import NULLABLE_TYPES
+from settings import STORAGE_COMPRESSION
+
+# file names of the download route
+CSV_FILENAME = 'data.csv'
+GZIP_FILENAME = 'data.csv.gz'
+PARQUET_FILENAME = 'data.parquet'
+
+# block size of the Parquet export as it is sent
+FILE_BLOCK_BYTES = 1024 * 1024
+
+def iter_csv(tables):
+    """
+        CSV text of Arrow tables with the same columns, one table at a time, with the header in the first one
+    """
+    for i, table in enumerate(tables):
+        yield table.to_pandas(types_mapper=NULLABLE_TYPES.get).to_csv(index=False, header=(i == 0), encoding='utf-8')
+
+def iter_gzip_csv(tables):
+    """
+        gzip compressed CSV file of Arrow tables with the same columns, compressed one table at a time
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for text in iter_csv(tables):
+        data = compressor.compress(text.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def iter_parquet(tables):
+    """
+        Parquet file of Arrow tables with the same schema, written one row group per table to a temporary
+        file and sent in blocks, since a Parquet file is only complete once its footer is written
+    """
+    with tempfile.TemporaryFile() as parquet_file:
+        writer = None
+        for table in tables:
+            if writer is None:
+                writer = pq.ParquetWriter(parquet_file, table.schema, compression=STORAGE_COMPRESSION)
+            writer.write_table(table)
+        writer.close()
+
+        parquet_file.seek(0)
+        for block in iter(lambda: parquet_file.read(FILE_BLOCK_BYTES), b''):
+            yield block
+
+# content type and contents generator of each file of the download route
+DOWNLOAD_FORMATS = {
+    CSV_FILENAME: ('text/csv', iter_csv),
+    GZIP_FILENAME: ('application/gzip', iter_gzip_csv),
+    PARQUET_FILENAME: ('application/octet-stream', iter_parquet),
+}
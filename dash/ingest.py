@@ -0,0 +1,101 @@
+"""
+    Readers that stream an uploaded file into dataframes of a fixed number of rows,
+    so an upload is never decoded or parsed into memory all at once
+"""
+import base64
+import io
+import shutil
+import tempfile
+import openpyxl
+import pandas as pd
+from settings import INGEST_CHUNK_ROWS, INGEST_SPOOL_BYTES
+
+# base64 text is decoded in blocks of this many characters, a multiple of 4
+BASE64_BLOCK_CHARS = 4 * 64 * 1024
+
+class Base64Reader(io.RawIOBase):
+    """
+        Binary file-like object that decodes base64 text one block at a time
+    """
+    def __init__(self, text, start=0):
+        self._text = text
+        self._pos = start
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b) and self._pos < len(self._text):
+            block = self._text[self._pos:self._pos + BASE64_BLOCK_CHARS]
+            self._pos += len(block)
+            self._buffer += base64.b64decode(block)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+def open_upload_contents(contents):
+    """
+        Stream of the decoded bytes of the contents of the upload component,
+        a data URL of the form "data:<content type>;base64,<data>"
+    """
+    return io.BufferedReader(Base64Reader(contents, contents.index(',') + 1))
+
+def spool_to_file(stream):
+    """
+        Copy a stream into a seekable temporary file that is kept in memory while small
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_BYTES)
+    shutil.copyfileobj(stream, spooled)
+    spooled.seek(0)
+    return spooled
+
+def read_csv_chunks(stream, chunk_rows=INGEST_CHUNK_ROWS):
+    """
+        Iterate over a CSV file as dataframes of at most chunk_rows rows
+    """
+    for chunk in pd.read_csv(stream, chunksize=chunk_rows, encoding='utf-8'):
+        yield chunk
+
+def read_excel_chunks(stream, filename, chunk_rows=INGEST_CHUNK_ROWS):
+    """
+        Iterate over the first sheet of an Excel file as dataframes of at most chunk_rows rows.
+        xlsx files are streamed row by row; the older xls format has no streaming reader,
+        so it is loaded whole and then split into chunks.
+    """
+    excel_file = stream if stream.seekable() else spool_to_file(stream)
+    if filename.lower().endswith('.xls'):
+        for chunk in split_dataframe(pd.read_excel(excel_file), chunk_rows):
+            yield chunk
+        return
+
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows)
+        batch = []
+        start = 0
+        for row in rows:
+            # skip the empty rows left at the end of edited sheets
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) == chunk_rows:
+                yield make_chunk(batch, header, start)
+                start += len(batch)
+                batch = []
+        if batch:
+            yield make_chunk(batch, header, start)
+    finally:
+        workbook.close()
+
+def make_chunk(rows, header, start):
+    """
+        Dataframe of rows read from a sheet, numbered continuously across chunks like the CSV chunks
+    """
+    return pd.DataFrame(rows, columns=header, index=pd.RangeIndex(start, start + len(rows)))
+
+def split_dataframe(df, chunk_rows=INGEST_CHUNK_ROWS):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
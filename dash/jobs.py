@@ -0,0 +1,166 @@
+"""
+    Background processing of uploads in a local pool of worker processes.
+    The state of each job is kept in a small JSON file in the jobs directory, so any
+    process of the app can report the progress of a job while it runs.
+"""
+import functools
+import json
+import multiprocessing
+import os
+import re
+import traceback
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import content_hash
+import db_engine as db
+import ingest
+from settings import UPLOAD_WORKERS, JOBS_DIR, JOB_TTL_SECONDS
+
+# job IDs are uuid4 hex strings, checked before they are used in a file path
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=UPLOAD_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def is_job_id(job_id):
+    return isinstance(job_id, str) and JOB_ID_PATTERN.match(job_id) is not None
+
+def get_status_path(job_id):
+    return os.path.join(JOBS_DIR, job_id + '.json')
+
+def get_upload_path(job_id):
+    return os.path.join(JOBS_DIR, job_id + '.upload')
+
+def get_failed_rows_path(job_id):
+    return os.path.join(JOBS_DIR, job_id + '_failed_rows.csv')
+
+def get_violations_path(job_id):
+    return os.path.join(JOBS_DIR, job_id + '_violations.csv')
+
+def submit_upload(new_dbinfo, contents, filename):
+    """
+        Save the decoded upload to the jobs directory, hashing it on the way, and queue it for parsing
+        as a new database unless the same file is already stored. Returns the job ID.
+    """
+    job_id, new_dbinfo.file_hash = save_upload(contents)
+    status = new_status(new_dbinfo.db_name)
+    duplicate = db.find_duplicate('File_hash', new_dbinfo.file_hash, new_dbinfo.db_id)
+    if duplicate is not None:
+        status.update(status='done', progress=1, message=db.duplicate_message(duplicate))
+        write_status(job_id, status)
+        os.remove(get_upload_path(job_id))
+        return job_id
+
+    write_status(job_id, status)
+    get_pool().submit(run_upload_job, job_id, filename, functools.partial(db.parse_new_database, new_dbinfo))
+    return job_id
+
+def submit_append(db_id, db_name, contents, filename):
+    """
+        Save the decoded upload to the jobs directory and queue it to add its rows to an existing
+        database (see db_engine.upsert_database). Returns the job ID.
+    """
+    job_id = save_upload(contents)[0]
+    write_status(job_id, new_status(db_name))
+    get_pool().submit(run_upload_job, job_id, filename, functools.partial(db.upsert_database, db_id))
+    return job_id
+
+def save_upload(contents):
+    """
+        Copy the decoded contents of the upload component to the upload file of a new job.
+        Returns the job ID and the content hash of the file.
+    """
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    remove_expired_jobs()
+    job_id = uuid.uuid4().hex
+    with open(get_upload_path(job_id), 'wb') as upload_file:
+        file_hash = content_hash.hash_stream(ingest.open_upload_contents(contents), upload_file)
+    return job_id, file_hash
+
+def new_status(db_name):
+    return {'status': 'queued', 'db_name': db_name, 'progress': 0,
+            'rows': 0, 'failed_rows': 0, 'violations': 0, 'message': ''}
+
+def run_upload_job(job_id, filename, parse):
+    """
+        Parse an upload in a worker process, recording its progress, the rows that could not be stored
+        and the values that did not pass the data checks. parse is db_engine.parse_new_database or
+        db_engine.upsert_database with their first argument bound, called with the chunks of rows
+        and the progress callbacks.
+    """
+    upload_path = get_upload_path(job_id)
+    status = read_status(job_id)
+    status['status'] = 'running'
+    write_status(job_id, status)
+    try:
+        with open(upload_path, 'rb') as upload_file:
+            file_size = max(os.path.getsize(upload_path), 1)
+            chunks = db.read_upload_chunks(upload_file, filename)
+            if chunks is None:
+                status.update(status='failed', message='Invalid file type.')
+                return
+
+            def on_chunk(num_rows):
+                status.update(rows=num_rows, progress=min(upload_file.tell() / file_size, 0.99))
+                write_status(job_id, status)
+
+            def on_failed_rows(failed_rows):
+                failed_rows_path = get_failed_rows_path(job_id)
+                failed_rows.to_csv(failed_rows_path, mode='a', index=False,
+                                   header=not os.path.exists(failed_rows_path))
+                status['failed_rows'] += len(failed_rows)
+
+            def on_violations(report):
+                violations_path = get_violations_path(job_id)
+                report.to_csv(violations_path, mode='a', index=False, header=not os.path.exists(violations_path))
+                status['violations'] += len(report)
+
+            message = parse(chunks, on_chunk, on_failed_rows, on_violations)
+            succeeded = message.startswith('Database')
+            status.update(status='done' if succeeded else 'failed', message=message,
+                          progress=1 if succeeded else status['progress'])
+    except Exception as e:
+        traceback.print_exc()
+        status.update(status='failed', message='There was an error processing this file.', error=str(e))
+    finally:
+        write_status(job_id, status)
+        os.remove(upload_path)
+
+def read_status(job_id):
+    """
+        State of a job: status (queued, running, done or failed), progress between 0 and 1,
+        rows stored so far, number of failed rows, number of values that did not pass the data checks
+        and the final message. Raises ValueError for an invalid job ID.
+    """
+    if not is_job_id(job_id):
+        raise ValueError('Invalid job ID')
+    with open(get_status_path(job_id)) as status_file:
+        return json.load(status_file)
+
+def write_status(job_id, status):
+    # write to a temporary file first so readers never see a partially written status
+    tmp_path = get_status_path(job_id) + '.tmp'
+    with open(tmp_path, 'w') as status_file:
+        json.dump(status, status_file)
+    os.replace(tmp_path, get_status_path(job_id))
+
+def remove_expired_jobs(ttl=JOB_TTL_SECONDS):
+    """
+        Delete the files of the jobs last written more than ttl seconds ago, so the jobs directory
+        does not grow with every upload
+    """
+    expiry = time.time() - ttl
+    for name in os.listdir(JOBS_DIR):
+        path = os.path.join(JOBS_DIR, name)
+        try:
+            if os.path.getmtime(path) < expiry:
+                os.remove(path)
+        except OSError:
+            # removed by another process in the meantime
+            pass
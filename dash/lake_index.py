@@ -0,0 +1,34 @@
+"""
+    Index of the samples of each lake in date order, so the samples of one lake are found
+    without scanning the whole dataframe
+"""
+import numpy as np
+import pandas as pd
+
+class LakeIndex:
+    """
+        The row positions are sorted by lake and then by date, so the samples of a lake are one
+        contiguous slice of them, delimited by the offsets of the lake codes. Samples without a
+        date come last in each lake, like in DataFrame.sort_values.
+    """
+    def __init__(self, names, dates):
+        names = pd.Categorical(names)
+        self.lakes = names.categories
+        codes = names.codes
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        date_keys = np.where(np.isnat(dates), np.iinfo(np.int64).max, dates.astype(np.int64))
+
+        # samples without a lake name are left out of the index
+        valid = np.flatnonzero(codes >= 0)
+        order = np.lexsort((date_keys[valid], codes[valid]))
+        self.positions = valid[order]
+        self.offsets = np.searchsorted(codes[self.positions], np.arange(len(self.lakes) + 1))
+
+    def get_positions(self, lake):
+        """
+            Positions of the samples of a lake in date order, empty if the lake is not in the index
+        """
+        code = self.lakes.get_indexer([lake])[0]
+        if code < 0:
+            return self.positions[:0]
+        return self.positions[self.offsets[code]:self.offsets[code + 1]]
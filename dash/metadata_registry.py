@@ -0,0 +1,191 @@
+"""
+    Registry of the uploaded databases and their metadata in an SQLite database.
+    Uploads add one row instead of rewriting the whole metadata file, and every change
+    increments a counter, so the metadata table only reads the rows changed since its last refresh.
+"""
+import os
+import sqlite3
+import threading
+import pandas as pd
+
+# columns of the metadata of a database, in the order of the former MetadataDB.csv,
+# followed by the content hashes of the uploaded file and of the stored rows (see content_hash.py)
+COLUMNS = ['DB_ID', 'DB_name', 'Uploaded_by', 'Upload_date', 'Published', 'Field_method', 'Lab_method', 'QA_QC',
+           'QA_QC_Request', 'Microcystin_method', 'N_lakes', 'N_samples', 'Published_url', 'Field_method_url',
+           'Lab_method_url', 'QA_QC_url', 'Full_QA_QC_url', 'Substrate', 'Sample_type', 'Field-method', 'Filter_size',
+           'Cell_count_method', 'Ancillary_data', 'File_hash', 'Content_hash']
+INTEGER_COLUMNS = ['N_lakes', 'N_samples']
+# columns that databases are looked up by, besides DB_ID
+INDEXED_COLUMNS = ['Uploaded_by', 'Microcystin_method', 'Upload_date', 'File_hash', 'Content_hash']
+
+class MetadataRegistry:
+    """
+        Each row records the value of the change counter when it was last written (Version).
+        Writes run in an immediate transaction, so concurrent uploads from several processes
+        are serialized by SQLite and never lose each other's rows.
+        The registry is created on first use, importing the rows of csv_path if that file exists.
+    """
+    def __init__(self, db_path, csv_path=None):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self._created = False
+        self._lock = threading.Lock()
+
+    def add(self, metadata):
+        """
+            Insert the metadata of a database, a dict of column values, replacing any previous
+            row of the same DB_ID. Returns the new value of the change counter.
+        """
+        with self._transaction() as connection:
+            return self._insert(connection, [metadata.get(col) for col in COLUMNS])
+
+    def update(self, db_id, values):
+        """
+            Change some of the column values of a database, a dict of column values.
+            Returns the new value of the change counter.
+        """
+        columns = [col for col in COLUMNS if col in values and col != 'DB_ID']
+        with self._transaction() as connection:
+            version = self._next_version(connection)
+            connection.execute('UPDATE databases SET %s, Version = ? WHERE DB_ID = ?' %
+                               ', '.join('"%s" = ?' % col for col in columns),
+                               [values[col] for col in columns] + [version, db_id])
+        return version
+
+    def increment(self, db_id, increments, values=None):
+        """
+            Add amounts to integer columns of a database (a dict of column increments) and change
+            some of its other column values, in one transaction, so concurrent appends to a database
+            never lose each other's counts. Returns the new value of the change counter.
+        """
+        increments = {col: increments[col] for col in INTEGER_COLUMNS if col in increments}
+        values = values or {}
+        columns = [col for col in COLUMNS if col in values and col != 'DB_ID' and col not in increments]
+        assignments = ['"%s" = COALESCE("%s", 0) + ?' % (col, col) for col in increments] + \
+                      ['"%s" = ?' % col for col in columns]
+        with self._transaction() as connection:
+            version = self._next_version(connection)
+            connection.execute('UPDATE databases SET %s, Version = ? WHERE DB_ID = ?' % ', '.join(assignments),
+                               list(increments.values()) + [values[col] for col in columns] + [version, db_id])
+        return version
+
+    def get_change_counter(self):
+        with self._connect() as connection:
+            return connection.execute('SELECT change_counter FROM registry_state').fetchone()[0]
+
+    def get_all(self):
+        """
+            Metadata of all the databases in upload order
+        """
+        return self.get_changes(0)[1]
+
+    def get_changes(self, since):
+        """
+            Current value of the change counter and the metadata of the databases written after
+            the counter had the value since, read through the index on Version
+        """
+        with self._connect() as connection:
+            counter = connection.execute('SELECT change_counter FROM registry_state').fetchone()[0]
+            changes = pd.read_sql_query('SELECT %s FROM databases WHERE Version > ? ORDER BY Version' %
+                                        column_list(COLUMNS), connection, params=[since])
+        return counter, changes
+
+    def find(self, column, value):
+        """
+            Metadata of the databases whose column (DB_ID or one of INDEXED_COLUMNS) equals value
+        """
+        if column != 'DB_ID' and column not in INDEXED_COLUMNS:
+            raise ValueError('No index on column %s' % column)
+        with self._connect() as connection:
+            return pd.read_sql_query('SELECT %s FROM databases WHERE "%s" = ? ORDER BY Version' %
+                                     (column_list(COLUMNS), column), connection, params=[value])
+
+    def get_values(self, column, db_ids):
+        """
+            Values of a column for the given databases, as a dict keyed by DB_ID
+        """
+        db_ids = list(db_ids)
+        with self._connect() as connection:
+            rows = connection.execute('SELECT DB_ID, "%s" FROM databases WHERE DB_ID IN (%s)' %
+                                      (column, ', '.join(['?'] * len(db_ids))), db_ids).fetchall()
+        return dict(rows)
+
+    def _connect(self):
+        with self._lock:
+            if not self._created:
+                self._create()
+                self._created = True
+        return RegistryConnection(self.db_path)
+
+    def _transaction(self):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def _create(self):
+        connection = RegistryConnection(self.db_path)
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('CREATE TABLE IF NOT EXISTS databases (%s, Version INTEGER NOT NULL)' %
+                               ', '.join('"%s" %s' % (col, column_type(col)) for col in COLUMNS))
+            # registries created by earlier versions of the app are missing the columns added since
+            existing = [row[1] for row in connection.execute('PRAGMA table_info(databases)')]
+            for col in COLUMNS:
+                if col not in existing:
+                    connection.execute('ALTER TABLE databases ADD COLUMN "%s" %s' % (col, column_type(col)))
+            connection.execute('CREATE INDEX IF NOT EXISTS databases_version ON databases (Version)')
+            for col in INDEXED_COLUMNS:
+                connection.execute('CREATE INDEX IF NOT EXISTS "databases_%s" ON databases ("%s")' % (col, col))
+            connection.execute('CREATE TABLE IF NOT EXISTS registry_state '
+                               '(id INTEGER PRIMARY KEY CHECK (id = 0), change_counter INTEGER NOT NULL)')
+            connection.execute('INSERT OR IGNORE INTO registry_state VALUES (0, 0)')
+
+            # a new registry starts with the databases of the metadata file of earlier versions of the app
+            counter = connection.execute('SELECT change_counter FROM registry_state').fetchone()[0]
+            if counter == 0 and self.csv_path is not None and os.path.exists(self.csv_path):
+                self._import_csv(connection)
+
+    def _import_csv(self, connection):
+        imported = pd.read_csv(self.csv_path).reindex(columns=COLUMNS)
+        imported = imported.astype(object).where(imported.notnull(), None)
+        for row in imported.itertuples(index=False):
+            self._insert(connection, list(row))
+
+    def _insert(self, connection, row):
+        version = self._next_version(connection)
+        connection.execute('INSERT OR REPLACE INTO databases (%s, Version) VALUES (%s)' %
+                           (column_list(COLUMNS), ', '.join(['?'] * (len(COLUMNS) + 1))), row + [version])
+        return version
+
+    def _next_version(self, connection):
+        connection.execute('UPDATE registry_state SET change_counter = change_counter + 1')
+        return connection.execute('SELECT change_counter FROM registry_state').fetchone()[0]
+
+class RegistryConnection(sqlite3.Connection):
+    """
+        SQLite connection in autocommit mode whose "with" block commits the open transaction,
+        or rolls it back on an error, and then closes the connection
+    """
+    def __init__(self, db_path):
+        super().__init__(db_path, timeout=30, isolation_level=None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.in_transaction:
+                self.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+        finally:
+            self.close()
+        return False
+
+def column_type(col):
+    if col == 'DB_ID':
+        return 'TEXT PRIMARY KEY'
+    if col in INTEGER_COLUMNS:
+        return 'INTEGER'
+    return 'TEXT'
+
+def column_list(columns):
+    return ', '.join('"%s"' % col for col in columns)
@@ -0,0 +1,22 @@
+"""
+    One-shot migration of the databases saved as Pickle files in the data directory
+    into the columnar Parquet storage, of stored databases with text dates into
+    native datetime columns, of stored databases written before the compact column types,
+    and of databases uploaded without a content hash
+    (or with a content hash of an earlier format).
+    Run from the dash directory: python migrate_storage.py
+"""
+import db_engine as db
+
+if __name__ == '__main__':
+    for db_id in db.migrate_pickles():
+        print('Migrated', db_id)
+    for db_id in db.migrate_date_fields():
+        print('Added date fields to', db_id)
+    for db_id in db.migrate_column_types():
+        print('Gave compact column types to', db_id)
+    migrated, duplicates = db.migrate_content_hashes()
+    for db_id in migrated:
+        print('Computed the content hash of', db_id)
+    for db_id, duplicate_id in duplicates:
+        print(db_id, 'holds the same data as', duplicate_id)
@@ -0,0 +1,136 @@
+"""
+    Registry of the columns of the GLEON template: how each column is named in the uploaded files
+    and in the app, how its values are converted and typed when a file is stored, and whether
+    it is offered in the dropdowns of the graphs
+"""
+import pandas as pd
+
+class Column:
+    """
+        A column of the app. source_name is its name in the GLEON template, or None for the derived
+        columns computed when a selection is loaded. factor converts the uploaded unit into the unit
+        of name. dtype is 'datetime', 'text', 'category' (text with few distinct values), 'float'
+        or 'count' (numbers stored as integers when they are whole). plottable columns are offered
+        in the dropdowns of the graphs. valid_range is the (minimum, maximum) of the values of a
+        numeric column, in the unit of the app, checked by validation.py; None means no limit.
+    """
+    def __init__(self, source_name, name, dtype='float', factor=1, plottable=True, valid_range=(0, None)):
+        self.source_name = source_name
+        self.name = name
+        self.dtype = dtype
+        self.factor = factor
+        self.plottable = plottable
+        self.valid_range = valid_range if self.is_numeric else None
+
+    @property
+    def is_numeric(self):
+        return self.dtype in ('float', 'count')
+
+    @property
+    def is_derived(self):
+        return self.source_name is None
+
+COLUMNS = [
+    Column('Date', 'DATETIME', 'datetime', plottable=False),
+    Column('LakeName', 'Body of Water Name', 'category', plottable=False),
+    # the coordinates are checked together by validation.check_coordinates
+    Column('Lat', 'LAT', plottable=False, valid_range=None),
+    Column('Long', 'LONG', plottable=False, valid_range=None),
+    Column('Altitude_m', 'Altitude (m)', valid_range=(-500, 9000)),
+    Column('MaximumDepth_m', 'Maximum Depth (m)', plottable=False),
+    Column('MeanDepth_m', 'Mean Depth (m)', plottable=False),
+    Column('SecchiDepth_m', 'Secchi Depth (m)'),
+    Column('SamplingDepth_m', 'Sampling Depth (m)'),
+    Column('ThermoclineDepth_m', 'Thermocline Depth (m)'),
+    Column('SurfaceTemperature_C', 'Surface Temperature (degrees celsius)', valid_range=(-5, 50)),
+    Column('EpilimneticTemperature_C', 'Epilimnetic Temperature (degrees celsius)', valid_range=(-5, 50)),
+    Column('TP_mgL', 'Total Phosphorus (ug/L)', factor=1000),
+    Column('TN_mgL', 'Total Nitrogen (ug/L)', factor=1000),
+    Column('NO3NO2_mgL', 'NO3 NO2 (mg/L)'),
+    Column('NH4_mgL', 'NH4 (mg/L)'),
+    Column('PO4_ugL', 'PO4 (ug/L)'),
+    Column('Chlorophylla_ugL', 'Total Chlorophyll a (ug/L)'),
+    Column('Chlorophyllb_ugL', 'Total Chlorophyll b (ug/L)'),
+    Column('Zeaxanthin_ugL', 'Zeaxanthin (ug/L)'),
+    Column('Diadinoxanthin_ugL', 'Diadinoxanthin (ug/L)'),
+    Column('Fucoxanthin_ugL', 'Fucoxanthin (ug/L)'),
+    Column('Diatoxanthin_ugL', 'Diatoxanthin (ug/L)'),
+    Column('Alloxanthin_ugL', 'Alloxanthin (ug/L)'),
+    Column('Peridinin_ugL', 'Peridinin (ug/L)'),
+    Column('Chlorophyllc2_ugL', 'Total Chlorophyll c2 (ug/L)'),
+    Column('Echinenone_ugL', 'Echinenone (ug/L)'),
+    Column('Lutein_ugL', 'Lutein (ug/L)'),
+    Column('Violaxanthin_ugL', 'Violaxanthin (ug/L)'),
+    Column('TotalMC_ug/L', 'Microcystin (ug/L)'),
+    Column('DissolvedMC_ugL', 'DissolvedMC (ug/L)'),
+    Column('MC_YR_ugL', 'Microcystin YR (ug/L)'),
+    Column('MC_dmRR_ugL', 'Microcystin dmRR (ug/L)'),
+    Column('MC_RR_ugL', 'Microcystin RR (ug/L)'),
+    Column('MC_dmLR_ugL', 'Microcystin dmLR (ug/L)'),
+    Column('MC_LR_ugL', 'Microcystin LR (ug/L)'),
+    Column('MC_LY_ugL', 'Microcystin LY (ug/L)'),
+    Column('MC_LW_ugL', 'Microcystin LW (ug/L)'),
+    Column('MC_LF_ugL', 'Microcystin LF (ug/L)'),
+    Column('NOD_ugL', 'Nodularin (ug/L)'),
+    Column('CYN_ugL', 'Cytotoxin Cylindrospermopsin (ug/L)'),
+    Column('ATX_ugL', 'Neurotoxin Anatoxin-a (ug/L)'),
+    Column('GEO_ugL', 'Geosmin (ug/L)'),
+    Column('2MIB_ngL', '2-MIB (ng/L)'),
+    Column('TotalPhyto_CellsmL', 'Phytoplankton (Cells/mL)', 'count'),
+    Column('Cyano_CellsmL', 'Cyanobacteria (Cells/mL)', 'count'),
+    Column('PercentCyano', 'Relative Cyanobacterial Abundance (percent)', valid_range=(0, 100)),
+    Column('DominantBloomGenera', 'Dominant Bloom', 'category', plottable=False),
+    Column('mcyD_genemL', 'mcyD gene (gene/mL)', 'count'),
+    Column('mcyE_genemL', 'mcyE gene (gene/mL)', 'count'),
+    Column('DataContact', 'DataContact', 'category', plottable=False),
+    Column('Comments', 'Comments', 'text', plottable=False),
+    # computed by db_engine.add_derived_metrics when a selection is loaded
+    Column(None, 'TN:TP'),
+    Column(None, 'Microcystin:Chlorophyll a'),
+    Column(None, 'MC Percent Change', plottable=False),
+]
+
+COLUMNS_BY_NAME = {column.name: column for column in COLUMNS}
+# template column names and the column names used in the app
+SOURCE_NAMES = {column.source_name: column.name for column in COLUMNS if not column.is_derived}
+DERIVED_COLUMNS = [column.name for column in COLUMNS if column.is_derived]
+# columns identifying a sample, for duplicate rows and rows added to an existing database
+ROW_KEY_COLUMNS = ['Body of Water Name', 'DATETIME', 'Sampling Depth (m)']
+
+def get_column(name):
+    """
+        Column of the registry with the given app name, or None for a column that is not in the template
+    """
+    return COLUMNS_BY_NAME.get(name)
+
+def get_names(dtype):
+    return [column.name for column in COLUMNS if column.dtype == dtype]
+
+def coerce_columns(df):
+    """
+        Give each column of a dataframe with app column names its registered type: numbers for the
+        numeric columns, converted to the unit of the app, and text for the text columns and the columns
+        that are not in the template. Dates are left to the caller. Returns the converted dataframe and
+        the number of values of each numeric column that are not numbers and were left empty.
+    """
+    df = df.copy()
+    errors = {}
+    for col in df.columns:
+        column = get_column(col)
+        if column is not None and column.dtype == 'datetime':
+            continue
+        elif column is None or not column.is_numeric:
+            df[col] = df[col].astype(str).astype(object).where(df[col].notnull(), None)
+        else:
+            values = pd.to_numeric(df[col], errors='coerce').astype(float)
+            failed = int((values.isnull() & df[col].notnull()).sum())
+            if failed > 0:
+                errors[col] = failed
+            df[col] = values * column.factor if column.factor != 1 else values
+    return df, errors
+
+def get_plottable_columns(columns):
+    """
+        Sorted names of the columns that can be drawn on the graphs among the given column names
+    """
+    return sorted(col for col in columns if col in COLUMNS_BY_NAME and COLUMNS_BY_NAME[col].plottable)
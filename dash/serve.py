@@ -0,0 +1,29 @@
+"""
+    Start the app on the gunicorn production server with the worker settings of settings.py.
+    Run from the dash directory: python serve.py
+    For development, run app.py instead to get the Dash debugger and reloader.
+"""
+from gunicorn.app.base import BaseApplication
+from settings import SERVER_BIND, SERVER_WORKERS, SERVER_THREADS, SERVER_TIMEOUT
+
+class ProductionServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self):
+        # each worker process imports the app itself, so no threads or process pools are forked
+        from wsgi import application
+        return application
+
+if __name__ == '__main__':
+    ProductionServer({
+        'bind': SERVER_BIND,
+        'workers': SERVER_WORKERS,
+        'threads': SERVER_THREADS,
+        'timeout': SERVER_TIMEOUT,
+    }).run()
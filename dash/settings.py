@@ -1,11 +1,11 @@
 """
     Constant values utilized in Dash application
 """
-import pandas as pd
-import numpy as np
 
-# Read in database info from the matadata file
-metadataDB = pd.read_csv("data/MetadataDB.csv")
+# Registry of the database info of the uploaded databases, read when it is needed (see db_engine.load_metadata).
+# A new registry imports the metadata file written by earlier versions of the app.
+METADATA_DB_PATH = "data/metadata.sqlite"
+METADATA_PATH = "data/MetadataDB.csv"
 
 # Establish range of months and years that exist in data
 months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
@@ -14,3 +14,56 @@ months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct",
 USEPA_LIMIT = 4
 WHO_LIMIT = 20
 
+
+# Server-side cache of the selected dataframes
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_TTL_SECONDS = 60 * 60
+# Arrow files of the selected dataframes, so the worker processes of the production server load a
+# selection built by another worker instead of building it again
+SHARED_CACHE_DIR = "data/cache"
+SHARED_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Storage of the uploaded databases
+DATA_DIR = "data"
+STORAGE_COMPRESSION = "zstd"
+LOADER_THREADS = 8
+
+# Uploads are parsed and stored this many rows at a time
+INGEST_CHUNK_ROWS = 50000
+# Excel uploads are decoded into memory up to this size, and into a temporary file beyond it
+INGEST_SPOOL_BYTES = 16 * 1024 * 1024
+# Values reported below a detection limit (ex. "<0.1") are stored as this fraction of the limit
+DETECTION_LIMIT_FACTOR = 0.5
+# Downloads of the selected data are written and sent this many rows at a time
+DOWNLOAD_CHUNK_ROWS = 10000
+
+# Background processing of uploads
+UPLOAD_WORKERS = 2
+JOBS_DIR = "data/jobs"
+JOB_POLL_INTERVAL_MS = 1000
+# the status, failed rows and data check reports of a job are deleted this long after it was submitted
+JOB_TTL_SECONDS = 7 * 24 * 3600
+
+# Size in degrees of the grid cells of the spatial index over sample locations
+SPATIAL_CELL_DEGREES = 1.0
+# Visible area of the map is widened by this factor so small pans do not show missing points
+GEO_VIEWPORT_MARGIN = 1.2
+# The concentration map groups the visible samples into clusters when there are more than this many
+GEO_CLUSTER_MIN_POINTS = 2000
+# Size in degrees of the cluster cells on the fully zoomed out map, divided by the zoom scale when zooming in
+GEO_CLUSTER_CELL_DEGREES = 4.0
+
+# Largest number of points sent to the browser for a temporal graph, more are downsampled
+PLOT_POINT_BUDGET = 2000
+
+# Scatter graphs are drawn with WebGL above this many points when WEBGL_MODE is 'auto',
+# or always ('always') or never ('never')
+WEBGL_MODE = 'auto'
+WEBGL_POINT_THRESHOLD = 10000
+
+# Production server started by serve.py: address, number of worker processes,
+# threads per worker and seconds before a busy worker is restarted
+SERVER_BIND = "0.0.0.0:8050"
+SERVER_WORKERS = 4
+SERVER_THREADS = 4
+SERVER_TIMEOUT = 120
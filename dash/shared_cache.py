@@ -0,0 +1,90 @@
+"""
+    Cache of materialized dataframes across the worker processes of the app, so a selection is
+    only built from the databases once. The dataframes are kept as uncompressed Arrow IPC files.
+"""
+import hashlib
+import os
+import time
+import uuid
+import pyarrow as pa
+
+class SharedFrameStore:
+    """
+        One file per key in cache_dir. A dataframe built by one worker is loaded by the others
+        from its file instead of being built again from the databases. Each worker that loads it
+        holds its own copy in memory: the memory is not shared between the workers.
+        Files that have not been read for longer than the time-to-live are ignored, and the least
+        recently read files are removed once the files take more than max_bytes.
+    """
+    def __init__(self, cache_dir, max_bytes, ttl_seconds):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.arrow')
+
+    def get(self, key):
+        """
+            return the dataframe stored under key, or None if it is missing or expired
+        """
+        path = self.get_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            # the file is memory-mapped so it is converted from the page cache without an extra
+            # read buffer; the conversion to pandas still copies the columns into this worker
+            with pa.memory_map(path) as source:
+                df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+            # the modification time records the last read, for the eviction order
+            os.utime(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return df
+
+    def put(self, key, df):
+        """
+            store df under key and remove the least recently read files beyond the size budget
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.get_path(key)
+        # write to a temporary file first so other workers never map a partially written file
+        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        self.prune()
+
+    def prune(self):
+        """
+            Remove the expired files, then the least recently read ones until the files fit the size budget
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.arrow'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if time.time() - stat.st_mtime > self.ttl_seconds:
+                remove_file(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for mtime, size, path in entries)
+        # always keep the newest file, even if it alone is over the budget
+        for mtime, size, path in sorted(entries)[:-1]:
+            if total_bytes <= self.max_bytes:
+                break
+            remove_file(path)
+            total_bytes -= size
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,131 @@
+"""
+    Grid index over the sample locations (LAT, LONG) of a dataframe, for bounding box and radius queries,
+    and grid clustering of samples for drawing them on a zoomed-out map
+"""
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0
+
+class SpatialIndex:
+    """
+        Samples are bucketed into a grid of cell_degrees x cell_degrees cells. The row positions
+        are sorted by cell, so the samples of a band of neighbouring cells on the same latitude
+        row are one contiguous slice, found with a binary search on the cell offsets.
+        Queries return sorted row positions into the indexed dataframe, for use with iloc.
+    """
+    def __init__(self, lat, lon, cell_degrees):
+        self.cell_degrees = cell_degrees
+        self.n_rows = int(np.ceil(180 / cell_degrees))
+        self.n_cols = int(np.ceil(360 / cell_degrees))
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+
+        # samples without valid coordinates are left out of the index
+        valid = np.flatnonzero(np.isfinite(self.lat) & np.isfinite(self.lon) &
+                               (np.abs(self.lat) <= 90) & (np.abs(self.lon) <= 180))
+        cells = self._get_cells(self.lat[valid], self.lon[valid])
+        order = np.argsort(cells, kind='mergesort')
+        self.positions = valid[order]
+        self.cells = cells[order]
+
+    def query_bbox(self, lat_min, lat_max, lon_min, lon_max):
+        """
+            Positions of the samples inside a bounding box. The box crosses the antimeridian when lon_min > lon_max.
+        """
+        lat_min, lat_max = max(lat_min, -90), min(lat_max, 90)
+        if lat_min > lat_max:
+            return np.array([], dtype=int)
+        if lon_min > lon_max:
+            return np.union1d(self.query_bbox(lat_min, lat_max, lon_min, 180),
+                              self.query_bbox(lat_min, lat_max, -180, lon_max))
+        lon_min, lon_max = max(lon_min, -180), min(lon_max, 180)
+
+        row_min, row_max = self._get_row(lat_min), self._get_row(lat_max)
+        col_min, col_max = self._get_col(lon_min), self._get_col(lon_max)
+        candidates = self._get_candidates(row_min, row_max, col_min, col_max)
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        inside = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        return np.sort(candidates[inside])
+
+    def query_radius(self, lat, lon, radius_km):
+        """
+            Positions of the samples within radius_km kilometres (great-circle distance) of a point
+        """
+        lat_delta = np.degrees(radius_km / EARTH_RADIUS_KM)
+        if abs(lat) + lat_delta >= 90:
+            # the circle contains a pole, so it spans every longitude
+            lon_min, lon_max = -180, 180
+        else:
+            lon_delta = np.degrees(np.arcsin(min(np.sin(radius_km / EARTH_RADIUS_KM) / np.cos(np.radians(lat)), 1)))
+            lon_min, lon_max = wrap_longitude(lon - lon_delta), wrap_longitude(lon + lon_delta)
+            if lon_delta >= 180:
+                lon_min, lon_max = -180, 180
+        candidates = self.query_bbox(lat - lat_delta, lat + lat_delta, lon_min, lon_max)
+        distances = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        return candidates[distances <= radius_km]
+
+    def _get_candidates(self, row_min, row_max, col_min, col_max):
+        rows = np.arange(row_min, row_max + 1)
+        starts = np.searchsorted(self.cells, rows * self.n_cols + col_min, side='left')
+        ends = np.searchsorted(self.cells, rows * self.n_cols + col_max, side='right')
+        slices = [self.positions[start:end] for start, end in zip(starts, ends) if end > start]
+        if not slices:
+            return np.array([], dtype=int)
+        return np.concatenate(slices)
+
+    def _get_row(self, lat):
+        return min(int((lat + 90) // self.cell_degrees), self.n_rows - 1)
+
+    def _get_col(self, lon):
+        return min(int((lon + 180) // self.cell_degrees), self.n_cols - 1)
+
+    def _get_cells(self, lat, lon):
+        rows = np.minimum(((lat + 90) // self.cell_degrees).astype(int), self.n_rows - 1)
+        cols = np.minimum(((lon + 180) // self.cell_degrees).astype(int), self.n_cols - 1)
+        return rows * self.n_cols + cols
+
+def cluster_samples(lat, lon, values, cell_degrees, limits):
+    """
+        Group samples into grid cells of cell_degrees and summarize each non-empty cell: its mean
+        location (LAT, LONG), number of samples (Count), largest value (Max), and for each
+        name and limit in limits the fraction of measured values above the limit ("Fraction > name").
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    values = np.asarray(values, dtype=float)
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon, values = lat[valid], lon[valid], values[valid]
+
+    n_cols = int(np.ceil(360 / cell_degrees))
+    rows = np.floor((lat + 90) / cell_degrees).astype(int)
+    cols = np.minimum(np.floor((lon + 180) / cell_degrees).astype(int), n_cols - 1)
+    cells, cluster = np.unique(rows * n_cols + cols, return_inverse=True)
+    n_clusters = len(cells)
+
+    count = np.bincount(cluster, minlength=n_clusters)
+    measured = np.isfinite(values)
+    n_measured = np.bincount(cluster, weights=measured, minlength=n_clusters)
+    max_value = np.full(n_clusters, -np.inf)
+    np.maximum.at(max_value, cluster[measured], values[measured])
+    max_value[np.isinf(max_value)] = np.nan
+
+    clusters = pd.DataFrame({
+        'LAT': np.bincount(cluster, weights=lat, minlength=n_clusters) / count,
+        'LONG': np.bincount(cluster, weights=lon, minlength=n_clusters) / count,
+        'Count': count,
+        'Max': max_value,
+    })
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name, limit in limits.items():
+            above = np.bincount(cluster, weights=measured & (np.nan_to_num(values) > limit), minlength=n_clusters)
+            clusters['Fraction > ' + name] = above / n_measured
+    return clusters
+
+def wrap_longitude(lon):
+    return (lon + 180) % 360 - 180
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
@@ -0,0 +1,92 @@
+"""
+    Tests of the content hashes of the stored databases (content_hash.py): the hash of a database
+    only depends on its rows, not on how they were uploaded or appended.
+    Run from the dash directory: python -m pytest tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_engine as db
+from db_info import db_info
+from metadata_registry import MetadataRegistry
+
+def make_upload(n_rows):
+    """
+        Rows in the GLEON template. The total nitrogen of the first half fits a float32 and the second
+        half has more digits, and the dissolved microcystin of the first half is empty, so the two
+        halves are stored with different columns and types.
+    """
+    rng = np.random.RandomState(0)
+    half = n_rows // 2
+    nitrogen = rng.lognormal(0, 1, n_rows).round(3)
+    nitrogen[half:] += 1e-7
+    dissolved = rng.lognormal(0, 1, n_rows).round(2)
+    dissolved[:half] = np.nan
+    return pd.DataFrame({
+        'Date': pd.Timestamp('2005-01-01') + pd.to_timedelta(np.arange(n_rows), unit='D'),
+        'LakeName': ['Lake %d' % i for i in rng.randint(0, 20, n_rows)],
+        'Lat': rng.uniform(40, 60, n_rows),
+        'Long': rng.uniform(-120, -80, n_rows),
+        'SamplingDepth_m': rng.randint(0, 5, n_rows).astype(float),
+        'TN_mgL': nitrogen,
+        'TotalMC_ug/L': rng.lognormal(0, 1, n_rows).round(3),
+        'DissolvedMC_ugL': dissolved,
+    })
+
+class ContentHashTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.storage, self.registry = db.storage, db.metadata_registry
+        db.storage = db.ParquetStorage(self.data_dir, 'zstd')
+        db.metadata_registry = MetadataRegistry(os.path.join(self.data_dir, 'metadata.sqlite'))
+
+    def tearDown(self):
+        db.storage, db.metadata_registry = self.storage, self.registry
+        shutil.rmtree(self.data_dir)
+
+    def upload(self, name, df):
+        info = db_info(name, 'tester', 'institution')
+        return info.db_id, db.parse_new_database(info, df)
+
+    def get_content_hash(self, db_id):
+        return db.metadata_registry.get_values('Content_hash', [db_id])[db_id]
+
+    def test_upserting_identical_rows_keeps_the_hash(self):
+        upload = make_upload(800)
+        db_id, message = self.upload('Identical', upload)
+        uploaded_hash = self.get_content_hash(db_id)
+        message = db.upsert_database(db_id, upload)
+        self.assertIn('800 rows added, 800 of them replacing stored rows', message)
+        self.assertEqual(self.get_content_hash(db_id), uploaded_hash)
+        self.assertEqual(db.storage.get_content_hash(db_id), uploaded_hash)
+
+    def test_hash_does_not_depend_on_the_files(self):
+        upload = make_upload(800)
+        db_id, message = self.upload('Split', upload.iloc[:400])
+        db.upsert_database(db_id, upload.iloc[400:])
+        self.assertEqual(len(db.storage.get_paths(db_id)), 2)
+
+        # the same rows uploaded at once are recognized as the data of the split database
+        whole_id, message = self.upload('Whole', upload.sample(frac=1, random_state=1).reset_index(drop=True))
+        self.assertIn('already holds the data of this file', message)
+        self.assertFalse(db.storage.exists(whole_id))
+
+    def test_changed_rows_change_the_hash(self):
+        upload = make_upload(800)
+        db_id, message = self.upload('Changed', upload)
+        uploaded_hash = self.get_content_hash(db_id)
+        changed = upload.iloc[:1].copy()
+        changed['TotalMC_ug/L'] += 1
+        db.upsert_database(db_id, changed)
+        self.assertNotEqual(self.get_content_hash(db_id), uploaded_hash)
+        db.upsert_database(db_id, upload.iloc[:1])
+        self.assertEqual(self.get_content_hash(db_id), uploaded_hash)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+    Tests of the downloads streamed from the stored files (db_engine.query_batches and export.py)
+    Run from the dash directory: python -m pytest tests
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_engine as db
+import export
+from db_info import db_info
+from metadata_registry import MetadataRegistry
+from test_content_hash import make_upload
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.storage, self.registry = db.storage, db.metadata_registry
+        db.storage = db.ParquetStorage(self.data_dir, 'zstd')
+        db.metadata_registry = MetadataRegistry(os.path.join(self.data_dir, 'metadata.sqlite'))
+        self.db_ids = []
+        upload = make_upload(600)
+        # the second database is missing the dissolved microcystin column
+        for name, rows in [('First', upload.iloc[300:]), ('Second', upload.iloc[:300])]:
+            info = db_info(name, 'tester', 'institution')
+            db.parse_new_database(info, rows)
+            self.db_ids.append(info.db_id)
+        db.upsert_database(self.db_ids[0], make_upload(20).assign(LakeName='Appended'))
+
+    def tearDown(self):
+        db.storage, db.metadata_registry = self.storage, self.registry
+        shutil.rmtree(self.data_dir)
+
+    def test_csv_has_the_rows_of_every_file(self):
+        tables = list(db.storage.query_batches(self.db_ids, batch_rows=100))
+        self.assertTrue(all(table.schema.equals(tables[0].schema) for table in tables))
+        self.assertTrue(all(table.num_rows <= 100 for table in tables))
+
+        downloaded = pd.read_csv(io.StringIO(''.join(export.iter_csv(db.query_batches(self.db_ids)))))
+        materialized = db.materialize(self.db_ids).df
+        self.assertEqual(len(downloaded), 620)
+        self.assertEqual(list(downloaded.columns), [col for col in materialized.columns if col != 'MC Percent Change'])
+        self.assertEqual(downloaded['Body of Water Name'].value_counts()['Appended'], 20)
+        pd.testing.assert_series_equal(downloaded['TN:TP'], materialized['TN:TP'].reset_index(drop=True),
+                                       check_dtype=False)
+
+    def test_filters_are_pushed_down(self):
+        filters = [('Body of Water Name', '==', 'Appended')]
+        tables = list(db.storage.query_batches(self.db_ids, filters))
+        self.assertEqual(sum(table.num_rows for table in tables), 20)
+        self.assertEqual(db.query_batches(self.db_ids + ['Unknown_database']), None)
+
+if __name__ == '__main__':
+    unittest.main()
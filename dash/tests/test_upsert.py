@@ -0,0 +1,59 @@
+"""
+    Tests of the rows added to existing databases (db_engine.upsert_database)
+    Run from the dash directory: python -m pytest tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_engine as db
+from db_info import db_info
+from metadata_registry import MetadataRegistry
+from test_content_hash import make_upload
+
+class UpsertTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.storage, self.registry = db.storage, db.metadata_registry
+        db.storage = db.ParquetStorage(self.data_dir, 'zstd')
+        db.metadata_registry = MetadataRegistry(os.path.join(self.data_dir, 'metadata.sqlite'))
+        info = db_info('Upsert', 'tester', 'institution')
+        self.upload = make_upload(600)
+        db.parse_new_database(info, self.upload.iloc[:200])
+        self.db_id = info.db_id
+
+    def tearDown(self):
+        db.storage, db.metadata_registry = self.storage, self.registry
+        shutil.rmtree(self.data_dir)
+
+    def get_metadata(self):
+        return db.metadata_registry.find('DB_ID', self.db_id).iloc[0]
+
+    def test_concurrent_appends_keep_every_row(self):
+        chunks = [self.upload.iloc[start:start + 50] for start in range(200, 600, 50)]
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            messages = list(pool.map(lambda chunk: db.upsert_database(self.db_id, chunk), chunks))
+        self.assertTrue(all('successfully updated' in message for message in messages), messages)
+        self.assertEqual(len(db.storage.get_paths(self.db_id)), 1 + len(chunks))
+        self.assertEqual(len(db.storage.read(self.db_id)), 600)
+        self.assertEqual(self.get_metadata()['N_samples'], 600)
+        self.assertEqual(self.get_metadata()['Content_hash'], db.storage.get_content_hash(self.db_id))
+
+    def test_part_files_without_rows_are_removed(self):
+        db.upsert_database(self.db_id, self.upload.iloc[200:300])
+        db.upsert_database(self.db_id, self.upload.iloc[200:300])
+        self.assertEqual(len(db.storage.get_paths(self.db_id)), 2)
+        self.assertEqual(len(db.storage.read(self.db_id)), 300)
+        self.assertEqual(self.get_metadata()['N_samples'], 300)
+
+    def test_unknown_database(self):
+        message = db.upsert_database('Unknown_database', self.upload)
+        self.assertEqual(message, 'There is no database "Unknown_database".')
+        self.assertFalse(os.path.exists(db.storage.get_parts_dir('Unknown_database')))
+
+if __name__ == '__main__':
+    unittest.main()
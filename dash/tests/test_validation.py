@@ -0,0 +1,39 @@
+"""
+    Tests of the data checks of the uploaded rows (validation.py)
+    Run from the dash directory: python -m pytest tests
+"""
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_engine import format_chunk
+from validation import Validator
+
+class ValidationTest(unittest.TestCase):
+    def test_values_that_are_not_numbers_are_reported(self):
+        reports = []
+        validator = Validator(reports.append)
+        chunk = pd.DataFrame({
+            'Date': ['2010-06-01', '2010-06-02', '2010-06-03', '2010-06-04'],
+            'LakeName': ['Erie', 'Erie', 'Erie', 'Erie'],
+            'Lat': [42.2, 42.2, 42.2, 42.2],
+            'Long': [-81.2, -81.2, -81.2, -81.2],
+            'TP_mgL': ['0.02', 'n/a', '<0.01', np.nan],
+            'TotalMC_ug/L': [1.5, 2.5, 'high', 'nd'],
+        })
+        chunk = format_chunk(chunk, validator=validator)
+        report = pd.concat(reports, ignore_index=True)
+        not_parsed = report[report['Rule'] == 'could not parse as a number'].sort_values('Row')
+        self.assertEqual(not_parsed['Row'].tolist(), [3, 4])
+        self.assertEqual(not_parsed['Column'].tolist(), ['Total Phosphorus (ug/L)', 'Microcystin (ug/L)'])
+        self.assertEqual(not_parsed['Value'].tolist(), ['n/a', 'high'])
+        self.assertEqual(not_parsed['Action'].tolist(), ['cleared', 'cleared'])
+        # detection limits and values reported as not detected are not counted as unparsed
+        self.assertEqual(validator.counts['could not parse as a number'], 2)
+        self.assertEqual(chunk['Microcystin (ug/L)'].isnull().tolist(), [False, False, True, True])
+
+if __name__ == '__main__':
+    unittest.main()
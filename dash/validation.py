@@ -0,0 +1,192 @@
+"""
+    Data quality checks of the uploaded rows, run on whole columns at a time. Each problem found
+    is recorded in a report with one row per value: its row number in the uploaded file, the column,
+    the value (as uploaded for detection limits, in the unit of the app otherwise), the rule it breaks
+    and what was done with it (Action):
+    "substituted" for values replaced by a number, "cleared" for values left empty,
+    and "flagged" for values that are kept as they are.
+"""
+import collections
+import numpy as np
+import pandas as pd
+from schema import COLUMNS, ROW_KEY_COLUMNS, get_column
+from settings import DETECTION_LIMIT_FACTOR
+
+REPORT_COLUMNS = ['Row', 'Column', 'Value', 'Rule', 'Action']
+# a number after "<" (below the detection limit) or ">" (above the quantification limit), ex. "< 0.1"
+LIMIT_PATTERN = r'^([<>])=?\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)$'
+# text reporting that an analyte was not detected, without a limit
+NOT_DETECTED = ['nd', 'n.d.', 'bdl', 'bd', '<dl', '<lod', 'not detected', 'below detection limit']
+
+class Validator:
+    """
+        Checks the chunks of rows of one upload. The keys of the rows seen in earlier chunks are
+        kept as 64-bit hashes, so duplicate samples are found across the whole file. The report of
+        each chunk is passed to on_violations, and counts holds the number of values per rule.
+    """
+    def __init__(self, on_violations=None):
+        self.on_violations = on_violations
+        self.counts = collections.Counter()
+        self._seen_keys = np.array([], dtype=np.uint64)
+
+    def parse_detection_limits(self, df):
+        """
+            Replace the values of the numeric columns reported against a detection limit, before the
+            columns are converted to numbers: "<x" becomes DETECTION_LIMIT_FACTOR * x, ">x" becomes x,
+            and "not detected" without a limit is cleared. df has the app column names.
+        """
+        reports = []
+        df = df.copy()
+        for col in df.columns:
+            column = get_column(col)
+            if column is None or not column.is_numeric or not is_text(df[col]):
+                continue
+            # only the values that are not numbers are parsed as text
+            numbers = pd.to_numeric(df[col], errors='coerce')
+            candidates = (numbers.isnull() & df[col].notnull()).to_numpy()
+            if not candidates.any():
+                continue
+            text = df[col][candidates].astype(str).str.strip()
+            limits = text.str.extract(LIMIT_PATTERN)
+            limit = pd.to_numeric(limits[1], errors='coerce').to_numpy()
+
+            values = numbers.to_numpy(dtype=object)
+            values[candidates] = df[col][candidates].to_numpy(dtype=object)
+            for rule, action, parsed, value in [
+                    ('below detection limit', 'substituted', (limits[0] == '<').to_numpy(), limit * DETECTION_LIMIT_FACTOR),
+                    ('above quantification limit', 'substituted', (limits[0] == '>').to_numpy(), limit),
+                    ('not detected, without a limit', 'cleared', text.str.lower().isin(NOT_DETECTED).to_numpy(), np.nan)]:
+                mask = np.zeros(len(df), dtype=bool)
+                mask[np.flatnonzero(candidates)[parsed]] = True
+                reports.append(make_report(df, mask, col, df[col], rule, action))
+                values[mask] = value[parsed] if np.ndim(value) else value
+            df[col] = values
+        self._record(reports)
+        return df
+
+    def check_parsed(self, uploaded, parsed):
+        """
+            Report the values of the numeric columns that could not be parsed as numbers and were left
+            empty by the conversion of the columns: the values of uploaded, before the conversion,
+            that are missing in parsed, after it
+        """
+        reports = []
+        for col in parsed.columns:
+            column = get_column(col)
+            if column is None or not column.is_numeric or col not in uploaded.columns:
+                continue
+            cleared = (parsed[col].isnull() & uploaded[col].notnull()).to_numpy()
+            reports.append(make_report(uploaded, cleared, col, uploaded[col], 'could not parse as a number', 'cleared'))
+        self._record(reports)
+
+    def check(self, df):
+        """
+            Check the ranges of the numeric columns, the coordinates, the lake names and duplicate
+            samples of a chunk whose columns have been converted to the types and units of the app.
+            Values out of range and invalid coordinates are cleared, the other problems are flagged.
+        """
+        df = df.copy()
+        reports = []
+        for column in COLUMNS:
+            if column.valid_range is None or column.name not in df.columns:
+                continue
+            values = df[column.name].to_numpy(dtype=float)
+            low, high = column.valid_range
+            with np.errstate(invalid='ignore'):
+                outside = np.zeros(len(df), dtype=bool)
+                if low is not None:
+                    outside |= values < low
+                if high is not None:
+                    outside |= values > high
+            if outside.any():
+                rule = 'outside the range {} to {}'.format('-inf' if low is None else low, 'inf' if high is None else high)
+                reports.append(make_report(df, outside, column.name, df[column.name], rule, 'cleared'))
+                values = values.copy()
+                values[outside] = np.nan
+                df[column.name] = values
+
+        reports += check_coordinates(df)
+        if 'Body of Water Name' in df.columns:
+            reports.append(make_report(df, df['Body of Water Name'].isnull().to_numpy(), 'Body of Water Name',
+                                       df['Body of Water Name'], 'missing lake name', 'flagged'))
+        reports.append(self._check_duplicates(df))
+        self._record(reports)
+        return df
+
+    def _check_duplicates(self, df):
+        """
+            Rows with the same lake, date and sampling depth as an earlier row of the upload
+        """
+        keys = pd.util.hash_pandas_object(df.reindex(columns=ROW_KEY_COLUMNS), index=False).to_numpy()
+        # the keys seen so far are kept sorted, and looked up with a binary search
+        duplicate = pd.Series(keys).duplicated().to_numpy()
+        if len(self._seen_keys) > 0:
+            positions = np.minimum(np.searchsorted(self._seen_keys, keys), len(self._seen_keys) - 1)
+            duplicate = duplicate | (self._seen_keys[positions] == keys)
+        self._seen_keys = np.sort(np.concatenate([self._seen_keys, keys]))
+        return make_report(df, duplicate, 'Body of Water Name', df.reindex(columns=['Body of Water Name']).iloc[:, 0],
+                           'duplicate lake, date and sampling depth', 'flagged')
+
+    def _record(self, reports):
+        reports = [report for report in reports if report is not None]
+        if not reports:
+            return
+        report = pd.concat(reports, ignore_index=True)
+        self.counts.update(report['Rule'].value_counts().to_dict())
+        if self.on_violations is not None:
+            self.on_violations(report)
+
+    def format_counts(self):
+        """
+            Sentence reporting the number of values of each rule, or an empty string if there were none
+        """
+        if not self.counts:
+            return ''
+        return ' {} values did not pass the data checks ({}).'.format(
+            sum(self.counts.values()), ', '.join('{}: {}'.format(rule, count) for rule, count in self.counts.most_common()))
+
+def check_coordinates(df):
+    """
+        Reports of the coordinates out of range (or with the latitude and longitude swapped) and
+        at 0, 0, which are cleared, and of the samples without coordinates, which are flagged
+    """
+    if 'LAT' not in df.columns or 'LONG' not in df.columns:
+        return []
+    lat = df['LAT'].to_numpy(dtype=float)
+    lon = df['LONG'].to_numpy(dtype=float)
+    with np.errstate(invalid='ignore'):
+        outside = (np.abs(lat) > 90) | (np.abs(lon) > 180)
+        swapped = outside & (np.abs(lat) <= 180) & (np.abs(lon) <= 90)
+        origin = (lat == 0) & (lon == 0)
+    missing = np.isnan(lat) | np.isnan(lon)
+
+    reports = []
+    for mask, rule in [(swapped, 'latitude and longitude swapped'), (outside & ~swapped, 'coordinates out of range'),
+                       (origin, 'coordinates at 0, 0')]:
+        reports.append(make_report(df, mask, 'LAT', df['LAT'], rule, 'cleared'))
+        reports.append(make_report(df, mask, 'LONG', df['LONG'], rule, 'cleared'))
+    cleared = outside | origin
+    if cleared.any():
+        df['LAT'] = np.where(cleared, np.nan, lat)
+        df['LONG'] = np.where(cleared, np.nan, lon)
+    reports.append(make_report(df, missing & ~cleared, 'LAT', df['LAT'], 'missing coordinates', 'flagged'))
+    return reports
+
+def make_report(df, mask, col, values, rule, action):
+    """
+        Report rows of the values of col where mask is True, or None if there are none. The row number
+        in the uploaded file counts the header line, like the row numbers of the failed rows.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.any():
+        return None
+    return pd.DataFrame({
+        'Row': df.index[mask] + 2,
+        'Column': col,
+        'Value': np.asarray(values)[mask].astype(object),
+        'Rule': rule,
+        'Action': action,
+    }, columns=REPORT_COLUMNS)
+
+def is_text(column):
+    return column.dtype == object or pd.api.types.is_string_dtype(column)
@@ -0,0 +1,7 @@
+"""
+    WSGI entry point of the app for production servers, for example from the dash directory:
+    gunicorn --workers 4 --threads 4 wsgi:server
+"""
+from app import server
+
+application = server